@@ -0,0 +1,409 @@
+# indexes.py
+# 排班用的内存索引（纯数据结构，不依赖 streamlit），由 scheduler.py 的变更函数增量维护。
+import heapq
+import itertools
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+from typing import Dict, Hashable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+Interval = Tuple[datetime, datetime, Hashable]
+
+class IntervalIndex:
+    """
+    每位员工一条按开始时间排序的区间表 [(start, end, key)]，用 bisect 维护。
+    next_start / overlapping 为 O(log n + k)，k 为跨过查询起点的区间数（通常 0~1）。
+    每位员工另有随增删维护的聚合：区间数 count、最晚结束 latest_end、总时长 total，均不用重扫。
+    给了 grid 时，每次 add/discard 同步到该 OccupancyGrid 的 layer 层。
+    """
+    def __init__(self, grid: Optional["OccupancyGrid"] = None, layer: str = ""):
+        self._grid, self._layer = grid, layer
+        self._rows: Dict[str, List[Interval]] = {}
+        self._where: Dict[Hashable, Tuple[str, datetime, datetime]] = {}
+        # 每位员工最长区间的时长，用来限定向前回看的范围
+        self._longest: Dict[str, timedelta] = {}
+        # 每位员工按结束时间排序的 (end, key)，以及区间总时长
+        self._ends: Dict[str, List[Tuple[datetime, Hashable]]] = {}
+        self._total: Dict[str, timedelta] = {}
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def add(self, emp: str, start: datetime, end: datetime, key: Hashable) -> None:
+        """
+        插入区间；key 已存在时视为改期/改时长（先删后插）。
+        """
+        if key in self._where:
+            self.discard(key)
+        insort(self._rows.setdefault(emp, []), (start, end, key))
+        insort(self._ends.setdefault(emp, []), (end, key))
+        self._total[emp] = self._total.get(emp, timedelta(0)) + (end - start)
+        self._where[key] = (emp, start, end)
+        if end - start > self._longest.get(emp, timedelta(0)):
+            self._longest[emp] = end - start
+        if self._grid is not None:
+            self._grid.add(self._layer, emp, start, end, key)
+
+    def discard(self, key: Hashable) -> None:
+        loc = self._where.pop(key, None)
+        if loc is None: return
+        emp, start, end = loc
+        rows = self._rows[emp]
+        i = bisect_left(rows, (start, end, key))
+        if i < len(rows) and rows[i][2] == key:
+            del rows[i]
+        ends = self._ends[emp]
+        i = bisect_left(ends, (end, key))
+        if i < len(ends) and ends[i][1] == key:
+            del ends[i]
+        self._total[emp] -= end - start
+        if self._grid is not None:
+            self._grid.discard(self._layer, key)
+
+    def intervals(self, emp: str) -> List[Interval]:
+        return self._rows.get(emp, [])
+
+    def count(self, emp: str) -> int:
+        return len(self._rows.get(emp, ()))
+
+    def latest_end(self, emp: str) -> Optional[datetime]:
+        ends = self._ends.get(emp)
+        return ends[-1][0] if ends else None
+
+    def total(self, emp: str) -> timedelta:
+        return self._total.get(emp, timedelta(0))
+
+    def iter_from(self, emp: str, t: datetime) -> Iterator[Interval]:
+        """
+        按开始时间遍历该员工结束时间晚于 t 的区间（含跨过 t 的那一个）。
+        """
+        rows = self._rows.get(emp)
+        if not rows: return iter(())
+        lo = bisect_left(rows, (t - self._longest.get(emp, timedelta(0)),))
+        return (r for r in itertools.islice(rows, lo, None) if r[1] > t)
+
+    def next_start(self, emp: str, t: datetime) -> Optional[datetime]:
+        """
+        该员工开始时间 >= t 的最早区间的开始时间。
+        """
+        rows = self._rows.get(emp)
+        if not rows: return None
+        i = bisect_left(rows, (t,))
+        return rows[i][0] if i < len(rows) else None
+
+    def overlapping(self, emp: str, start: datetime, end: datetime) -> Optional[Interval]:
+        """
+        返回与 [start, end) 重叠的第一个区间，没有则 None。
+        """
+        rows = self._rows.get(emp)
+        if not rows or end <= start: return None
+        lo = bisect_left(rows, (start - self._longest.get(emp, timedelta(0)),))
+        hi = bisect_left(rows, (end,))
+        for s, e, key in rows[lo:hi]:
+            if e > start:
+                return (s, e, key)
+        return None
+
+def earliest_gap(indexes, emp: str, t: datetime, duration: timedelta) -> datetime:
+    """
+    在若干区间索引（如已分配 + 预约占用）的并集之外，找该员工从 t 起第一段长度 >= duration 的空档，返回其开始时间。
+    只走到找到空档为止：O(log n + k)，k 为途经的区间数。
+    """
+    s = t
+    for a, b, _ in heapq.merge(*(ix.iter_from(emp, t) for ix in indexes), key=lambda x: x[0]):
+        if a >= s + duration: break
+        if b > s: s = b
+    return s
+
+def free_gaps(indexes, emp: str, t: datetime, until: datetime) -> Iterator[Tuple[datetime, datetime]]:
+    """
+    按时间顺序惰性给出该员工在 [t, until) 内的空档 (开始, 结束)。
+    """
+    s = t
+    for a, b, _ in heapq.merge(*(ix.iter_from(emp, t) for ix in indexes), key=lambda x: x[0]):
+        if a >= until: break
+        if a > s: yield (s, a)
+        if b > s: s = b
+    if s < until: yield (s, until)
+
+class OccupancyGrid:
+    """
+    员工 × 时间桶的占用计数表（NumPy），每层一张 int16 矩阵，例如 "busy"（已分配）与 "held"（预约）。
+    区间按桶向外取整（开始向下、结束向上），所以只会偏保守；add/discard 为 O(区间桶数)。
+    整天的可用性、每个时段的下一位等都是在这张表上的数组运算。
+    """
+    def __init__(self, origin: datetime, step: timedelta = timedelta(minutes=1),
+                 span: timedelta = timedelta(hours=36)):
+        self.origin, self.step = origin, step
+        self.width = int(span / step)
+        self._row: Dict[str, int] = {}
+        self._cells: Dict[str, np.ndarray] = {}
+        self._where: Dict[tuple, Tuple[str, int, int, int]] = {}
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._row)
+
+    def row(self, emp: str) -> int:
+        i = self._row.get(emp)
+        if i is None:
+            i = self._row[emp] = len(self._row)
+            for layer, cells in self._cells.items():
+                if i >= len(cells):
+                    self._cells[layer] = np.vstack([cells, np.zeros_like(cells)])
+        return i
+
+    def _layer(self, layer: str) -> np.ndarray:
+        cells = self._cells.get(layer)
+        if cells is None:
+            cells = self._cells[layer] = np.zeros((max(len(self._row), 8), self.width), dtype=np.int16)
+        return cells
+
+    def index(self, t: datetime, up: bool = False) -> int:
+        """
+        时刻 → 桶下标（up=True 向上取整），截到 [0, width]。
+        """
+        q, r = divmod(t - self.origin, self.step)
+        return min(max(q + (1 if up and r else 0), 0), self.width)
+
+    def at(self, i) -> datetime:
+        return self.origin + self.step * int(i)
+
+    def add(self, layer: str, emp: str, start: datetime, end: datetime, key: Hashable) -> None:
+        self.discard(layer, key)
+        i = self.row(emp)
+        cells = self._layer(layer)
+        a, b = self.index(start), self.index(end, up=True)
+        if b > a:
+            cells[i, a:b] += 1
+        self._where[(layer, key)] = (layer, i, a, b)
+
+    def discard(self, layer: str, key: Hashable) -> None:
+        loc = self._where.pop((layer, key), None)
+        if loc is None: return
+        layer, i, a, b = loc
+        if b > a:
+            self._cells[layer][i, a:b] -= 1
+
+    def occupied(self, emps: Sequence[str], layers: Optional[Sequence[str]] = None) -> np.ndarray:
+        """
+        这些员工（按给定顺序）各桶是否被占用，bool 矩阵 [len(emps), width]。
+        """
+        rows = [self.row(e) for e in emps]
+        out = np.zeros((len(rows), self.width), dtype=bool)
+        for layer in (layers if layers is not None else self._cells):
+            cells = self._cells.get(layer)
+            if cells is not None:
+                out |= cells[rows] > 0
+        return out
+
+    def next_starts(self, emps: Sequence[str], buckets: int, first: Sequence[int]) -> np.ndarray:
+        """
+        每位员工、每个桶 j：从 j 起能放下连续 buckets 个空桶的最早开始桶；放不下为 width。
+        first[k] 为第 k 位员工可开始的最早桶（如签到时间）。
+        """
+        occ = self.occupied(emps)
+        width = self.width
+        if buckets > 0:
+            # 窗口内占用数 = 前缀和之差
+            cs = np.zeros((len(emps), width + 1), dtype=np.int32)
+            np.cumsum(occ, axis=1, out=cs[:, 1:])
+            fits = np.zeros((len(emps), width), dtype=bool)
+            n = width - buckets + 1
+            if n > 0:
+                fits[:, :n] = (cs[:, buckets:] - cs[:, :n]) == 0
+        else:
+            fits = np.ones((len(emps), width), dtype=bool)
+        cols = np.arange(width)
+        fits &= cols >= np.asarray(first, dtype=np.int64).reshape(-1, 1)
+        idx = np.where(fits, cols, width)
+        return np.minimum.accumulate(idx[:, ::-1], axis=1)[:, ::-1]
+
+_REMOVED = object()
+
+class RotationQueue:
+    """
+    轮值优先队列，key 越小越靠前：(下一次空闲, 签到时间, 累计接待)。
+    update/remove 为 O(log E)（旧条目懒删除）；iter_ordered 按顺位惰性遍历，取前 k 位为 O(k log E)；
+    ordered() 缓存完整顺位，直到下一次 update/remove。
+    注意：遍历过程中不要 update，取到结果、结束遍历后再更新。
+    """
+    def __init__(self):
+        self._heap: List[list] = []
+        self._entry: Dict[str, list] = {}
+        self._seq = itertools.count()
+        self._cache: Optional[List] = None
+
+    def __len__(self) -> int:
+        return len(self._entry)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entry
+
+    def get(self, name: str):
+        entry = self._entry.get(name)
+        return entry[3] if entry is not None else None
+
+    def update(self, name: str, key: tuple, item) -> None:
+        old = self._entry.pop(name, None)
+        if old is not None: old[3] = _REMOVED
+        entry = [key, next(self._seq), name, item]
+        self._entry[name] = entry
+        heapq.heappush(self._heap, entry)
+        self._cache = None
+        if len(self._heap) > 2 * len(self._entry) + 16:
+            # 懒删除的旧条目太多时整理一次
+            self._heap = [e for e in self._heap if e[3] is not _REMOVED]
+            heapq.heapify(self._heap)
+
+    def remove(self, name: str) -> None:
+        old = self._entry.pop(name, None)
+        if old is not None:
+            old[3] = _REMOVED
+            self._cache = None
+
+    def iter_ordered(self) -> Iterator:
+        # 以堆顶为起点做一次“堆上的优先搜索”：每弹出一个节点，再放入它的两个子节点
+        heap = self._heap
+        if not heap: return
+        frontier = [(heap[0][0], heap[0][1], 0)]
+        while frontier:
+            _, _, i = heapq.heappop(frontier)
+            item = heap[i][3]
+            if item is not _REMOVED:
+                yield item
+            for c in (2 * i + 1, 2 * i + 2):
+                if c < len(heap):
+                    heapq.heappush(frontier, (heap[c][0], heap[c][1], c))
+
+    def ordered(self) -> List:
+        if self._cache is None:
+            self._cache = list(self.iter_ordered())
+        return self._cache
+
+class WaitingQueues:
+    """
+    等待批次按能力类别分队列：每个类别一条按 (到店时间, 批次ID) 排序的列表。
+    一个批次挂在所有能服务它的类别下；有员工空出时只看该员工所属类别的那几条。
+    """
+    def __init__(self):
+        self._lists: Dict[Hashable, List[tuple]] = {}
+        self._where: Dict[Hashable, Tuple[tuple, List[Hashable]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def add(self, key: Hashable, arrival: datetime, item, classes) -> None:
+        if key in self._where:
+            self.discard(key)
+        entry = (arrival, key, item)
+        classes = list(classes)
+        for c in classes:
+            insort(self._lists.setdefault(c, []), entry)
+        self._where[key] = (entry, classes)
+
+    def discard(self, key: Hashable) -> None:
+        loc = self._where.pop(key, None)
+        if loc is None: return
+        (arrival, _, _), classes = loc
+        for c in classes:
+            rows = self._lists[c]
+            i = bisect_left(rows, (arrival, key))
+            if i < len(rows) and rows[i][1] == key:
+                del rows[i]
+
+    def items(self, classes) -> List:
+        """
+        这些类别下的全部批次，按到店先后去重合并。
+        """
+        lists = [self._lists.get(c, []) for c in classes]
+        if len(lists) == 1:
+            return [x[2] for x in lists[0]]
+        seen = {}
+        for entry in heapq.merge(*lists, key=lambda x: x[:2]):
+            seen.setdefault(entry[1], entry[2])
+        return list(seen.values())
+
+class DueQueue:
+    """
+    到期队列：每个 key 至多一个到期时刻，min-heap + 懒删除（重排/取消只改 _when，旧条目弹出时丢弃）。
+    pop_due(t) 只弹出已到期的 key，没有到期时 O(1)。
+    """
+    def __init__(self):
+        self._heap: List[tuple] = []
+        self._when: Dict[Hashable, datetime] = {}
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._when)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._when
+
+    def schedule(self, key: Hashable, when: datetime) -> None:
+        if self._when.get(key) == when: return
+        self._when[key] = when
+        heapq.heappush(self._heap, (when, next(self._seq), key))
+        if len(self._heap) > 2 * len(self._when) + 16:
+            self._heap = [x for x in self._heap if self._when.get(x[2]) == x[0]]
+            heapq.heapify(self._heap)
+
+    def cancel(self, key: Hashable) -> None:
+        self._when.pop(key, None)
+
+    def peek(self) -> Optional[datetime]:
+        heap = self._heap
+        while heap and self._when.get(heap[0][2]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def pop_due(self, t: datetime) -> List[Hashable]:
+        out = []
+        heap = self._heap
+        while heap and heap[0][0] <= t:
+            when, _, key = heapq.heappop(heap)
+            if self._when.get(key) == when:
+                del self._when[key]
+                out.append(key)
+        return out
+
+class Ledger:
+    """
+    按员工 × 收款方式累计的账本：每个 key（记录）的入账额单独记下，变化时先冲销旧额再记新额，O(方式数)。
+    total 为全店合计，by_employee 为各员工合计，读取都不用扫记录。
+    """
+    def __init__(self, methods: Sequence[str]):
+        self.methods = tuple(methods)
+        self.total: Dict[str, float] = dict.fromkeys(self.methods, 0.0)
+        self.by_employee: Dict[str, Dict[str, float]] = {}
+        self._entry: Dict[Hashable, Tuple[str, Dict[str, float]]] = {}
+        self._count: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._entry)
+
+    def post(self, key: Hashable, emp: str, amounts: Dict[str, float]) -> None:
+        self.discard(key)
+        row = self.by_employee.setdefault(emp, dict.fromkeys(self.methods, 0.0))
+        for m in self.methods:
+            v = amounts.get(m, 0.0)
+            row[m] += v; self.total[m] += v
+        self._entry[key] = (emp, amounts)
+        self._count[emp] = self._count.get(emp, 0) + 1
+
+    def discard(self, key: Hashable) -> None:
+        entry = self._entry.pop(key, None)
+        if entry is None: return
+        emp, amounts = entry
+        row = self.by_employee[emp]
+        for m in self.methods:
+            v = amounts.get(m, 0.0)
+            row[m] -= v; self.total[m] -= v
+        self._count[emp] -= 1
+        if not self._count[emp]:
+            # 该员工已无入账：去掉整行，避免浮点残差
+            del self._count[emp], self.by_employee[emp]
+        if not self._entry:
+            self.total = dict.fromkeys(self.methods, 0.0)
+
@@ -0,0 +1,43 @@
+# matching.py
+# 等待队列“全局最优”派单用的最小费用二分匹配（匈牙利算法，纯 Python，不依赖 streamlit/scipy）。
+from typing import List, Tuple
+
+# 不可行配对的费用；远大于任何可行费用之和，保证先求最多配对、再求最小总费用
+INFEASIBLE = 1e9
+
+def min_cost_matching(cost: List[List[float]]) -> List[Tuple[int, int]]:
+    """
+    cost[i][j] 为第 i 位顾客配给第 j 位员工的费用（不可行填 INFEASIBLE），可为非方阵。
+    返回最小总费用下的可行配对 [(i, j)]，不可行的配对会被剔除。O(n²m)，n = min(行, 列)。
+    """
+    n = len(cost)
+    if n == 0 or not cost[0]: return []
+    m = len(cost[0])
+    if n > m:
+        flipped = [[cost[i][j] for i in range(n)] for j in range(m)]
+        return sorted((i, j) for j, i in min_cost_matching(flipped))
+
+    inf = float("inf")
+    u = [0.0] * (n + 1); v = [0.0] * (m + 1)
+    p = [0] * (m + 1); way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i; j0 = 0
+        minv = [inf] * (m + 1); used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]; row = cost[i0 - 1]
+            delta = inf; j1 = 0
+            for j in range(1, m + 1):
+                if used[j]: continue
+                cur = row[j - 1] - u[i0] - v[j]
+                if cur < minv[j]: minv[j] = cur; way[j] = j0
+                if minv[j] < delta: delta = minv[j]; j1 = j
+            for j in range(m + 1):
+                if used[j]: u[p[j]] += delta; v[j] -= delta
+                else: minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0: break
+        while j0:
+            j1 = way[j0]; p[j0] = p[j1]; j0 = j1
+    return sorted((p[j] - 1, j - 1) for j in range(1, m + 1)
+                  if p[j] and cost[p[j] - 1][j - 1] < INFEASIBLE)
@@ -0,0 +1,1160 @@
+# scheduler.py
+# 排班核心（不依赖 streamlit）：当日状态 DayStore、轮值/冲突/能力判断与全部变更函数。
+# streamlit_app_21.py 负责存储、会话与界面，启动时 bind() 当日的 DayStore；simulate.py 在虚拟时钟下直接驱动这些函数。
+import functools
+import heapq
+import threading
+from contextlib import contextmanager
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+import storage
+import numpy as np
+
+from indexes import (DueQueue, IntervalIndex, Ledger, OccupancyGrid, RotationQueue, WaitingQueues,
+                     earliest_gap, free_gaps)
+from matching import INFEASIBLE, min_cost_matching
+
+# ===== Time helpers (Melbourne) =====
+TZ = ZoneInfo("Australia/Melbourne")
+_clock: Optional[Callable[[], datetime]] = None
+# 每个线程（即每个会话的脚本运行）各自冻结的“当前时间”
+_frozen = threading.local()
+
+def live_now() -> datetime: return _clock() if _clock else datetime.now(TZ)
+
+def now() -> datetime:
+    t = getattr(_frozen, "t", None)
+    return t if t is not None else live_now()
+
+def set_clock(fn: Optional[Callable[[], datetime]]):
+    # 替换时间来源（模拟、快进回放）；传 None 恢复真实时间
+    global _clock
+    _clock = fn
+
+def freeze_clock(t: Optional[datetime] = None) -> datetime:
+    """
+    本线程此后的 now() 固定为 t（默认取当前时间），直到 unfreeze_clock()。一次运行开始时调用。
+    """
+    _frozen.t = t or live_now()
+    return _frozen.t
+
+def unfreeze_clock():
+    _frozen.t = None
+
+@contextmanager
+def frozen_clock(t: Optional[datetime] = None):
+    """
+    一次操作内 now() 不变；已冻结时沿用外层时间（除非显式给 t）。
+    """
+    prev = getattr(_frozen, "t", None)
+    _frozen.t = t or prev or live_now()
+    try:
+        yield _frozen.t
+    finally:
+        _frozen.t = prev
+
+def today_key() -> str: return now().strftime("%Y-%m-%d")
+def fmt(dt: Optional[datetime]) -> str: return dt.strftime("%Y-%m-%d %H:%M") if dt else ""
+def fmt_t(dt: Optional[datetime]) -> str: return dt.strftime("%H:%M") if dt else ""
+
+# ===== Serialization =====
+def parse_dt(s: Optional[str]) -> Optional[datetime]:
+    if not s: return None
+    x = datetime.fromisoformat(s)
+    return x if x.tzinfo else x.replace(tzinfo=TZ)
+
+def ser_employee(e: Dict) -> Dict:
+    return {
+        "name": e["name"],
+        "check_in": e["check_in"].isoformat(),
+        "next_free": e["next_free"].isoformat(),
+        "served_count": e["served_count"],
+        "role": e.get("role", "正式"),
+    }
+
+def ser_assignment(r: Dict) -> Dict:
+    return {
+        **{k: v for k, v in r.items() if k not in ("start", "end")},
+        "start": r["start"].isoformat(),
+        "end": r["end"].isoformat(),
+    }
+
+def ser_waiting(w: Dict) -> Dict:
+    return {
+        "customer_id": w["customer_id"],
+        "service": w["service"],
+        "arrival": w["arrival"].isoformat(),
+        "count": w["count"],
+    }
+
+def ser_reservation(r: Dict) -> Dict:
+    return {
+        "id": r["id"], "customer": r["customer"], "service": r["service"],
+        "employee": r["employee"], "start": r["start"].isoformat(),
+        "status": r.get("status","pending")
+    }
+
+SERIALIZERS = {
+    "employees": ser_employee, "assignments": ser_assignment,
+    "waiting": ser_waiting, "reservations": ser_reservation,
+}
+
+def serialize_state() -> Dict:
+    return {
+        "employees": [ser_employee(e) for e in S.employees],
+        "services": S.services,
+        "assignments": [ser_assignment(r) for r in S.assignments],
+        "waiting": [ser_waiting(w) for w in S.waiting],
+        "reservations": [ser_reservation(r) for r in S.reservations],
+        "_customer_seq": S._customer_seq,
+        "policy": S.policy,
+    }
+
+def reset_state(state: SimpleNamespace):
+    # 空的一天：项目目录保留
+    state.employees = []
+    state.assignments = []
+    state.waiting = []
+    state.reservations = []
+    state._customer_seq = 1
+    state._pending = {}
+
+def load_state(state: SimpleNamespace, store, day: str) -> bool:
+    data = store.load(day)
+    if data is None:
+        # 当天无数据（可能刚被其他进程清空）：不能留着旧数据，否则之后的写入会把旧行写回磁盘
+        reset_state(state)
+        return False
+    state.employees = [
+        {
+            "name": e["name"], "check_in": parse_dt(e["check_in"]),
+            "next_free": parse_dt(e["next_free"]),
+            "served_count": int(e.get("served_count", 0)),
+            "role": e.get("role", "正式"),
+        } for e in data.get("employees", [])
+    ]
+    state.services = data.get("services", state.services)
+    if data.get("policy") in DISPATCH_POLICIES: state.policy = data["policy"]
+    state.assignments = [
+        {
+            **{k: v for k, v in r.items() if k not in ("start", "end")},
+            "start": parse_dt(r["start"]), "end": parse_dt(r["end"]),
+        } for r in data.get("assignments", [])
+    ]
+    state.waiting = [
+        {
+            "customer_id": w["customer_id"], "service": w["service"],
+            "arrival": parse_dt(w["arrival"]), "count": int(w["count"]),
+        } for w in data.get("waiting", [])
+    ]
+    state.reservations = [
+        {
+            "id": r["id"], "customer": r["customer"], "service": r["service"],
+            "employee": r["employee"], "start": parse_dt(r["start"]),
+            "status": r.get("status", "pending"),
+        } for r in data.get("reservations", [])
+    ]
+    state._customer_seq = int(data.get("_customer_seq", 1))
+    state._pending = {}
+    return True
+
+# —— 变更日志：变更只登记事件，本次运行结束时由 flush_state() 一次写入 ——
+def put(table: str, *rows: Dict) -> List[Dict]:
+    return [storage.ev_put(table, SERIALIZERS[table](r)) for r in rows]
+
+def drop(table: str, keys) -> List[Dict]:
+    return [storage.ev_del(table, k) for k in keys]
+
+def seq_event() -> List[Dict]:
+    return [storage.ev_set("_customer_seq", S._customer_seq)]
+
+def journal(*groups: List[Dict], status_only: bool = False):
+    # 同一行在写入前多次变更，只保留最后一次；status_only 时只推进 status_version（见 DayStore）
+    with DAY.lock:
+        for g in groups:
+            for ev in g:
+                S._pending[storage.event_key(ev)] = ev
+                if status_only: DAY.status_version += 1
+                else: DAY.version += 1
+
+# ===== State init =====
+DEFAULT_SERVICES = [
+    # --- Deep Tissue Oil, Relaxation, Dry Massage ---
+    {"name": "NS (0 mins)", "minutes": 0, "price": 0.0},
+    {"name": "NS (1 mins)", "minutes": 1, "price": 45.0},
+    {"name": "NS (20 mins)", "minutes": 20, "price": 40.0},
+    {"name": "NS (30 mins)", "minutes": 30, "price": 50.0},
+    {"name": "NSHe (30 mins)", "minutes": 30, "price": 50.0},
+    {"name": "NSHe (45 mins)", "minutes": 45, "price": 75.0},
+    {"name": "BHi (30 mins)", "minutes": 30, "price": 50.0},
+    {"name": "BHi (45 mins)", "minutes": 45, "price": 75.0},
+    {"name": "L (30 mins)", "minutes": 30, "price": 50.0},
+    {"name": "L (45 mins)", "minutes": 45, "price": 75.0},
+    {"name": "NSB (45 mins)", "minutes": 45, "price": 75.0},
+    {"name": "NSB (60 mins)", "minutes": 60, "price": 100.0},
+    {"name": "NSAHa (45 mins)", "minutes": 45, "price": 75.0},
+    {"name": "NSAHa (60 mins)", "minutes": 60, "price": 100.0},
+    {"name": "NSBHe (50 mins)", "minutes": 50, "price": 85.0},
+    {"name": "NSBHe (60 mins)", "minutes": 60, "price": 100.0},
+    {"name": "BL (50 mins)", "minutes": 50, "price": 85.0},
+    {"name": "BL (60 mins)", "minutes": 60, "price": 100.0},
+    {"name": "NSBAHa (50 mins)", "minutes": 50, "price": 85.0},
+    {"name": "NSBAHa (70 mins)", "minutes": 70, "price": 120.0},
+    {"name": "NSBL (50 mins)", "minutes": 50, "price": 85.0},
+    {"name": "NSBL (70 mins)", "minutes": 70, "price": 120.0},
+    {"name": "WB (60 mins)", "minutes": 60, "price": 100.0},
+    {"name": "WB (90 mins)", "minutes": 90, "price": 150.0},
+
+    # --- Foot Massage & Packages ---
+    {"name": "F(R) (30 mins)", "minutes": 30, "price": 50.0},
+    {"name": "F(R) (60 mins)", "minutes": 60, "price": 100.0},
+    {"name": "NSF (50 mins)", "minutes": 50, "price": 85.0},
+    {"name": "NSBF (60 mins)", "minutes": 60, "price": 100.0},
+    {"name": "NSBLF (70 mins)", "minutes": 70, "price": 120.0},
+    {"name": "WBF (90 mins)", "minutes": 90, "price": 150.0},
+
+    # --- Special Treatment ---
+    {"name": "Pregnancy massage (45 mins)", "minutes": 45, "price": 75.0},
+    {"name": "Pregnancy massage (60 mins)", "minutes": 60, "price": 100.0},
+    {"name": "Children massage (20 mins)", "minutes": 20, "price": 40.0},
+    {"name": "Children massage (30 mins)", "minutes": 30, "price": 50.0},
+    {"name": "Sciatica/Frozen Shoulder/Tennis Elbow/Golf Elbow (30 mins)", "minutes": 30, "price": 50.0},
+    {"name": "Sciatica/Frozen Shoulder/Tennis Elbow/Golf Elbow (45 mins)", "minutes": 45, "price": 75.0},
+    {"name": "Cupping Therapy with herbal oil (30 mins)", "minutes": 30, "price": 50.0},
+    {"name": "Ear Candling & Face Massage (30 mins)", "minutes": 30, "price": 50.0},
+    {"name": "Neck, Shoulders & Back + Cupping (50 mins)", "minutes": 50, "price": 85.0},
+
+    # --- Dry Needling Therapy ---
+    {"name": "Dry Needling (First Session)", "minutes": 0, "price": 80.0},
+    {"name": "Dry Needling (Second+ Session)", "minutes": 0, "price": 70.0},
+    {"name": "Dry Needling + 40 mins Remedial massage", "minutes": 40, "price": 130.0},
+
+    # --- Remedial Massage (Health Fund Rebate) ---
+    {"name": "Remedial Massage (30 mins)", "minutes": 30, "price": 60.0},
+    {"name": "Remedial Massage (45 mins)", "minutes": 45, "price": 85.0},
+    {"name": "Remedial Massage (60 mins)", "minutes": 60, "price": 110.0},
+    {"name": "Remedial Massage (90 mins)", "minutes": 90, "price": 160.0},
+]
+
+# 预约未找到项目时长时，按该时长占用
+RESERVATION_DEFAULT_MINUTES = 30
+# 到期预约暂时排不上时，隔多久重试
+RESERVATION_RETRY = timedelta(minutes=1)
+
+def reservation_end(rv: Dict, services: Dict[str, Dict]) -> datetime:
+    svc = services.get(rv["service"])
+    minutes = int(svc["minutes"]) if svc and "minutes" in svc else RESERVATION_DEFAULT_MINUTES
+    return rv["start"] + timedelta(minutes=minutes)
+
+# ===== Capability mapping (English abbreviations aware) =====
+def service_tags(name: str):
+    raw = (name or "").strip()
+    n = raw.lower()
+    u = raw.upper()
+    tags = set()
+
+    # 脚/足/反射/含 F/NSF/NSHeF/WBF/NSBLF/NSBF
+    foot = ("foot" in n or "feet" in n or "reflexology" in n or
+            " F(" in f" {u}" or u.startswith("F(") or
+            " NSF" in f" {u}" or " NSHEF" in f" {u}" or
+            " NSBLF" in f" {u}" or " NSBF" in f" {u}" or
+            " WBF" in f" {u}" or u.endswith("F"))
+    if foot: tags.add("FOOT")
+
+    back = ("back" in n) or (" NSB" in f" {u}") or (" BHI" in f" {u}")
+    leg  = ("leg"  in n) or (" BL" in f" {u}") or (" NSBL" in f" {u}")
+    whole = ("whole" in n) or (" WB" in f" {u}") or u.startswith("WB")
+    if back: tags.add("BACK")
+    if leg: tags.add("LEG")
+    if whole: tags.add("WHOLE")
+
+    special_kw = ["remedial", "dry needling", "pregnancy", "children",
+                  "sciatica", "elbow", "hip", "cupping", "ear candling"]
+    if any(k in n for k in special_kw): tags.add("SPECIAL")
+
+    # NS/NSHe：包含颈/肩/头，但不含背/腿/全身/特殊/脚
+    ns_like = (u.startswith("NS") or "neck" in n or "shoulder" in n or "head" in n)
+    if ns_like and not (foot or back or leg or whole or any(k in n for k in special_kw)):
+        tags.add("NSH")
+
+    if not tags:
+        tags.add("OTHER")
+    return tags
+
+# 标签编译成位掩码；员工类型编译成 (需含其一, 不能含) 两个掩码，判断只需整数与运算
+TAGS = ("NSH", "FOOT", "BACK", "LEG", "WHOLE", "SPECIAL", "OTHER")
+TAG_BIT = {t: 1 << i for i, t in enumerate(TAGS)}
+
+def tag_mask(name: str) -> int:
+    m = 0
+    for t in service_tags(name): m |= TAG_BIT[t]
+    return m
+
+def mask_tags(mask: int) -> List[str]:
+    return [t for t in TAGS if mask & TAG_BIT[t]]
+
+_RESTRICTED = TAG_BIT["BACK"] | TAG_BIT["LEG"] | TAG_BIT["WHOLE"] | TAG_BIT["SPECIAL"]
+ROLE_MASKS = {
+    "正式": (0, 0),
+    # 只能 NS / NSHe
+    "新员工-初级": (TAG_BIT["NSH"], _RESTRICTED | TAG_BIT["FOOT"]),
+    # NS/NSHe + 脚，其它(背/腿/全身/特殊)不行
+    "新员工-中级": (TAG_BIT["NSH"] | TAG_BIT["FOOT"], _RESTRICTED),
+}
+ROLES = list(ROLE_MASKS)
+
+def role_allows(role: str, mask: int) -> bool:
+    # 未知类型按正式处理
+    need, deny = ROLE_MASKS.get(role, (0, 0))
+    return not (mask & deny) and (not need or bool(mask & need))
+
+def can_employee_do(emp: Dict, service: Dict) -> bool:
+    return role_allows(emp.get("role","正式"), DAY.mask_of(service))
+
+def capability_class(emp: Dict) -> str:
+    # 能力只由员工类型决定；未知类型按正式处理（与 can_employee_do 一致）
+    role = emp.get("role", "正式")
+    return role if role in ROLES else "正式"
+
+def waiting_classes(service: Dict) -> List[str]:
+    return DAY.roles_for(service)
+
+def status_at(start: datetime, end: datetime, t: datetime) -> str:
+    if end <= t: return "已完成"
+    return "进行中" if start <= t else "排队中"
+
+def rotation_key(e: Dict) -> tuple:
+    # 轮值顺序：下一次空闲 → 签到时间 → 累计接待
+    return (e["next_free"], e["check_in"], e["served_count"])
+
+class DayStore:
+    """
+    进程内共享的当日数据：所有会话读写同一份 state。
+    变更需持有 lock；每登记一次变更 version +1，会话据此判断是否需要整页刷新。
+    随时间自动推进的状态变化（refresh_status）只使 status_version +1：看板片段据此刷新，不触发整页重跑。
+    """
+    def __init__(self, day: str, store=None):
+        self.day = day
+        self.lock = threading.RLock()
+        self.version = 0
+        self.status_version = 0
+        # 派生数据（看板表格等）缓存：名称 -> (key, 值)，见 cached()
+        self.derived: Dict[str, tuple] = {}
+        self.state = SimpleNamespace(
+            employees=[], services=[dict(s) for s in DEFAULT_SERVICES],
+            assignments=[], waiting=[], reservations=[],
+            _customer_seq=1, _pending={}, policy="rotation",
+        )
+        # 不给 store 时为纯内存的一天（模拟用）
+        self.restored = load_state(self.state, store, day) if store is not None else False
+        self.reindex()
+
+    def reindex(self):
+        """
+        按当前 state 重建索引（载入/清空后调用），其余时候由各变更函数增量维护：
+        services_by_name / employees_by_name / assignments_by_id / reservations_by_id —— 按名称/ID 直接查找；
+        busy —— 每位员工的已分配区间；held —— 每位员工未到期预约占用的区间；
+        grid —— busy/held 的按分钟占用表（随 busy/held 自动同步），供整天的可用性数组运算；
+        rotation —— 员工轮值优先队列；waitq —— 按员工类型分类的等待批次；
+        ledger —— 已开始/已完成记录按员工 × 收款方式的营收账本（见 post_revenue）；
+        transitions —— 分配记录下一次状态变化（开始/结束）的到期队列；
+        due_reservations —— 未完成预约按开始时间的到期队列（完成即移出）。
+        """
+        state = self.state
+        self.compile_catalog()
+        self.services_by_name = {s["name"]: s for s in state.services}
+        self.employees_by_name = {e["name"]: e for e in state.employees}
+        self.assignments_by_id = {r["customer_id"]: r for r in state.assignments}
+        self.rotation = RotationQueue()
+        for e in state.employees:
+            self.rotation.update(e["name"], rotation_key(e), e)
+        t = now()
+        self.grid = OccupancyGrid(t.replace(hour=0, minute=0, second=0, microsecond=0))
+        self.busy = IntervalIndex(self.grid, "busy")
+        self.transitions = DueQueue()
+        for r in state.assignments:
+            self.busy.add(r["employee"], r["start"], r["end"], r["customer_id"])
+            self.track(r, t)
+        self.reservations_by_id = {rv["id"]: rv for rv in state.reservations}
+        self.held = IntervalIndex(self.grid, "held")
+        self.due_reservations = DueQueue()
+        for rv in state.reservations:
+            if rv.get("status","pending") != "done":
+                self.held.add(rv["employee"], rv["start"], reservation_end(rv, self.services_by_name), rv["id"])
+                self.due_reservations.schedule(rv["id"], rv["start"])
+        self.waitq = WaitingQueues()
+        for w in state.waiting:
+            self.waitq.add(w["customer_id"], w["arrival"], w, self.roles_for(w["service"]))
+        self.ledger = Ledger(REVENUE_METHODS)
+        for r in state.assignments:
+            post_revenue(r, self.ledger)
+
+    def track(self, rec: Dict, t: Optional[datetime] = None):
+        """
+        记录新建或改了开始/结束后调用：状态已过期则立即到期，否则排在下一个边界；已完成的不再跟踪。
+        """
+        t = t or now()
+        if status_at(rec["start"], rec["end"], t) != rec["status"]: when = t
+        elif t < rec["start"]: when = rec["start"]
+        elif t < rec["end"]: when = rec["end"]
+        else:
+            self.transitions.cancel(rec["customer_id"]); return
+        self.transitions.schedule(rec["customer_id"], when)
+
+    def compile_catalog(self):
+        """
+        项目目录 → 标签掩码；只在载入或“保存项目变更”后重编译。
+        matrix[项目名][员工类型] 即可做矩阵。
+        """
+        self.service_masks = {s["name"]: tag_mask(s["name"]) for s in self.state.services}
+        self.matrix = {n: {r: role_allows(r, m) for r in ROLES} for n, m in self.service_masks.items()}
+
+    def mask_of(self, service: Dict) -> int:
+        m = self.service_masks.get(service["name"])
+        # 目录外的项目名（如改名前登记的等待批次）临时计算
+        return m if m is not None else tag_mask(service["name"])
+
+    @property
+    def policy(self) -> str:
+        # 等待队列派单规则（全店共用，随当日数据保存），见 DISPATCH_POLICIES
+        return self.state.policy
+
+    @policy.setter
+    def policy(self, value: str):
+        self.state.policy = value
+
+    def cached(self, name: str, key, build: Callable[[], object]):
+        """
+        按 key（通常含 version）缓存派生数据，key 没变时直接复用，不再重建。
+        """
+        hit = self.derived.get(name)
+        if hit is not None and hit[0] == key: return hit[1]
+        value = build()
+        self.derived[name] = (key, value)
+        return value
+
+    def roles_for(self, service: Dict) -> List[str]:
+        row = self.matrix.get(service["name"])
+        if row is not None: return [r for r, ok in row.items() if ok]
+        m = tag_mask(service["name"])
+        return [r for r in ROLES if role_allows(r, m)]
+
+def check_state_data(day: str, data) -> None:
+    """
+    在临时的一天上按 data 完整载入并重建索引；数据不完整或格式不对时抛出异常。导入前调用，坏文件不落盘。
+    """
+    DayStore(day, SimpleNamespace(load=lambda _day: data))
+
+# 当前绑定的一天；变更函数都作用于它
+DAY: Optional[DayStore] = None
+S: Optional[SimpleNamespace] = None
+
+def bind(day: DayStore):
+    global DAY, S
+    DAY, S = day, day.state
+
+def locked(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        # 持锁期间时间也固定，整个变更看到同一个 now()
+        with DAY.lock, frozen_clock():
+            return fn(*args, **kwargs)
+    return wrapper
+
+PAYMENT_FIELDS = ("pay_cash","pay_transfer","pay_eftpos","pay_voucher","payment_note")
+
+# 账本的收款方式列；realized 为实收（未填写收款时按标价）
+REVENUE_METHODS = ("cash", "bank", "pos", "voucher", "realized")
+
+def revenue_amounts(rec: Dict) -> Dict[str, float]:
+    cash = rec.get("pay_cash",0.0); bank = rec.get("pay_transfer",0.0)
+    pos = rec.get("pay_eftpos",0.0); vou = rec.get("pay_voucher",0.0)
+    realized = cash + bank + pos + vou
+    if realized <= 0: realized = rec["price"]
+    return {"cash": cash, "bank": bank, "pos": pos, "voucher": vou, "realized": realized}
+
+def post_revenue(rec: Dict, ledger: Optional[Ledger] = None):
+    """
+    按记录当前状态/价格/收款重新入账；排队中的记录不计营收。
+    改动分配记录的状态、价格或收款后由改动方显式调用（put 只负责记日志）。
+    """
+    ledger = ledger if ledger is not None else DAY.ledger
+    if rec["status"] == "排队中":
+        ledger.discard(rec["customer_id"])
+    else:
+        ledger.post(rec["customer_id"], rec["employee"], revenue_amounts(rec))
+
+def ensure_payment_fields():
+    for rec in S.assignments:
+        for k in PAYMENT_FIELDS:
+            if k not in rec:
+                rec[k] = 0.0 if k!="payment_note" else ""
+
+@locked
+def update_payments(changes: Dict[int, Dict]) -> List[Dict]:
+    """
+    changes: {客户ID: {收款字段: 新值}}，只写入与现值不同的字段；返回实际改动的记录（没有改动则不登记日志）。
+    """
+    changed = []
+    for rid, fields in changes.items():
+        rec = DAY.assignments_by_id.get(rid)
+        if rec is None: continue
+        diff = {k: v for k, v in fields.items() if k in PAYMENT_FIELDS and rec.get(k) != v}
+        if diff:
+            rec.update(diff)
+            post_revenue(rec)
+            changed.append(rec)
+    journal(put("assignments", *changed))
+    return changed
+
+# ===== Core helpers =====
+# 只读查询也持锁：RotationQueue.ordered() 会缓存顺位，与其他会话的 update 交错会缓存到过期的顺序
+@locked
+def sorted_employees_for_rotation() -> List[Dict]:
+    return DAY.rotation.ordered()
+
+def touch_employee(e: Dict):
+    # next_free / check_in / served_count 改动后调用，更新其在轮值队列中的位置
+    DAY.rotation.update(e["name"], rotation_key(e), e)
+
+def settle_employee(e: Dict):
+    """
+    按 busy 的员工聚合值重设 served_count（记录数）与 next_free（最晚结束，不早于签到），并调整轮值位置。
+    记录新增、删除、加时、改期、提前结束后调用，O(log n)，不重扫当天记录。
+    """
+    name = e["name"]
+    e["served_count"] = DAY.busy.count(name)
+    e["next_free"] = max(DAY.busy.latest_end(name) or e["check_in"], e["check_in"])
+    touch_employee(e)
+
+def find_slot(e: Dict, minutes: int, t: datetime, extra=()) -> Tuple[datetime, datetime]:
+    """
+    该员工从 max(t, 签到) 起第一段放得下 minutes 的空档：已分配与预约占用之间、预约之后的空档都算。
+    extra 为额外占用（如团体规划中尚未落账的座位）。
+    """
+    start = earliest_gap((DAY.busy, DAY.held) + tuple(extra), e["name"], max(t, e["check_in"]),
+                         timedelta(minutes=minutes))
+    return start, start + timedelta(minutes=minutes)
+
+def find_assignment(service: Dict, arrival: datetime, prefer_employee: Optional[str] = None,
+                    queue: Optional[RotationQueue] = None, extra=()) -> Optional[Tuple[Dict, datetime, datetime]]:
+    """
+    能做该项目的员工里取最早能开始的空档，同样早时按轮值顺序；有人能在 arrival 当时开始就不再往后看。
+    指定员工（预约）时只看该员工，arrival 正是其预约时刻则按该预约落单。返回 (员工, 开始, 结束) 或 None。
+    """
+    queue = queue or DAY.rotation
+    minutes = service["minutes"]
+    if prefer_employee and prefer_employee in queue:
+        e = queue.get(prefer_employee)
+        if can_employee_do(e, service):
+            if DAY.held.next_start(e["name"], arrival) == arrival:
+                # 按该预约落单：held 里占着的正是这条预约，只避开已分配的记录。
+                # 不能用 next_free：补位可能已把散客排在预约之后，next_free 会越过预约时刻
+                start = earliest_gap((DAY.busy,) + tuple(extra), e["name"], max(arrival, e["check_in"]),
+                                     timedelta(minutes=minutes))
+                return e, start, start + timedelta(minutes=minutes)
+            return (e, *find_slot(e, minutes, arrival, extra))
+    best = None
+    for e in queue.iter_ordered():
+        if not can_employee_do(e, service): continue
+        start, end = find_slot(e, minutes, arrival, extra)
+        if best is None or start < best[1]:
+            best = (e, start, end)
+            if start <= arrival: break
+    return best
+
+# 电话预约可选时刻的间隔（分钟）；空档的起点本身也会列出
+SLOT_STEP_MINUTES = 15
+
+def slot_starts(e: Dict, minutes: int, t: datetime, until: datetime) -> Iterator[datetime]:
+    """
+    该员工在 [t, until) 内所有放得下 minutes 的开始时刻：每段空档的起点，及其后按 SLOT_STEP_MINUTES 对齐的时刻。
+    """
+    d, step = timedelta(minutes=minutes), timedelta(minutes=SLOT_STEP_MINUTES)
+    for gs, ge in free_gaps((DAY.busy, DAY.held), e["name"], max(t, e["check_in"]), until):
+        if ge - gs < d: continue
+        yield gs
+        x = gs.replace(second=0, microsecond=0)
+        x += timedelta(minutes=-x.minute % SLOT_STEP_MINUTES)
+        if x <= gs: x += step
+        while x + d <= ge:
+            yield x
+            x += step
+
+@locked
+def find_free_slots(service: Dict, earliest: datetime, employee: Optional[str] = None,
+                    n: int = 5, until: Optional[datetime] = None) -> List[Dict]:
+    """
+    电话预约查询：从 max(earliest, 现在) 起到当天结束，最早的 n 个可开始时刻。
+    考虑能力、已分配与已有预约；employee 为空时列出该时刻所有可约员工（按轮值顺序）。
+    返回 [{"start", "end", "employees": [...]}]；各员工的空档惰性合并，只走到第 n 个时刻为止。
+    """
+    t = max(earliest, now())
+    until = until or datetime.combine(t.date(), datetime.min.time(), tzinfo=t.tzinfo) + timedelta(days=1)
+    if employee:
+        e = DAY.employees_by_name.get(employee)
+        emps = [e] if e is not None and can_employee_do(e, service) else []
+    else:
+        emps = [e for e in DAY.rotation.ordered() if can_employee_do(e, service)]
+    def stream(rank, e):
+        for start in slot_starts(e, service["minutes"], t, until):
+            yield start, rank, e["name"]
+    streams = [stream(rank, e) for rank, e in enumerate(emps)]
+    out: List[Dict] = []
+    for start, _, name in heapq.merge(*streams):
+        if out and out[-1]["start"] == start:
+            out[-1]["employees"].append(name); continue
+        if len(out) == n: break
+        out.append({"start": start, "end": start + timedelta(minutes=service["minutes"]), "employees": [name]})
+    return out
+
+@locked
+def slot_conflict(emp_name: str, start: datetime, end: datetime) -> Optional[str]:
+    """
+    [start, end) 与该员工已分配或预约占用重叠时返回说明。
+    """
+    hit = DAY.busy.overlapping(emp_name, start, end)
+    if hit: return f"与已分配 {fmt_t(hit[0])}–{fmt_t(hit[1])} 重叠"
+    hit = DAY.held.overlapping(emp_name, start, end)
+    if hit: return f"与预约 {fmt_t(hit[0])}–{fmt_t(hit[1])} 重叠"
+    return None
+
+def _slot_times(start: datetime, until: datetime, step_minutes: int) -> List[datetime]:
+    step = timedelta(minutes=step_minutes)
+    t = start.replace(second=0, microsecond=0)
+    t += timedelta(minutes=-t.minute % step_minutes)
+    out = []
+    while t < until:
+        out.append(t); t += step
+    return out
+
+@locked
+def next_by_slot(service: Dict, start: datetime, until: datetime,
+                 step_minutes: int = SLOT_STEP_MINUTES) -> List[Dict]:
+    """
+    从 start 到 until 每个对齐的时段：该项目的下一位是谁、最早几点能开始。
+    基于 DAY.grid 一次数组运算算出所有时段，同样早时按轮值顺序；时间按分钟向上取整，与实际分配可能差不到一分钟。
+    返回 [{"slot", "employee", "start", "end"}]，无人可做时 employee 为 None。
+    """
+    g = DAY.grid
+    slots = _slot_times(start, until, step_minutes)
+    emps = [e for e in DAY.rotation.ordered() if can_employee_do(e, service)]
+    if not emps or not slots:
+        return [{"slot": t, "employee": None, "start": None, "end": None} for t in slots]
+    d = timedelta(minutes=service["minutes"])
+    nxt = g.next_starts([e["name"] for e in emps], -(-d // g.step),
+                        [g.index(e["check_in"], up=True) for e in emps])
+    cols = [g.index(t, up=True) for t in slots]
+    sub = nxt[:, cols]
+    best = sub.argmin(axis=0)
+    out = []
+    for k, t in enumerate(slots):
+        i = int(sub[best[k], k])
+        if i >= g.width:
+            out.append({"slot": t, "employee": None, "start": None, "end": None}); continue
+        begin = max(g.at(i), t)
+        out.append({"slot": t, "employee": emps[best[k]]["name"], "start": begin, "end": begin + d})
+    return out
+
+@locked
+def occupancy_by_slot(start: datetime, until: datetime, step_minutes: int = SLOT_STEP_MINUTES):
+    """
+    热力图数据：已签到员工在 [start, until) 内每个时段的已分配/预约占用比例（0–1）。
+    返回 (员工名, 时段开始, busy[员工, 时段], held[员工, 时段])。
+    """
+    g = DAY.grid
+    names = [e["name"] for e in S.employees]
+    per = max(int(timedelta(minutes=step_minutes) // g.step), 1)
+    a = g.index(start) // per * per
+    k = max((g.index(until, up=True) - a + per - 1) // per, 0)
+    k = min(k, (g.width - a) // per)
+    slots = [g.at(a + j * per) for j in range(k)]
+    def frac(layer):
+        occ = g.occupied(names, [layer])[:, a:a + k * per]
+        return occ.reshape(len(names), k, per).mean(axis=2) if k else np.zeros((len(names), 0))
+    return names, slots, frac("busy"), frac("held")
+
+@locked
+def next_eligible_employee(service: Dict, at_time: datetime) -> Optional[Dict]:
+    """
+    返回 {"employee", "start", "end"} 或 None（无人能做该项目）。
+    """
+    found = find_assignment(service, at_time)
+    if found is None: return None
+    return {"employee": found[0], "start": found[1], "end": found[2]}
+
+def next_reservation_block(emp_name: str, ref_start: datetime) -> Optional[datetime]:
+    return DAY.held.next_start(emp_name, ref_start)
+
+def next_assignment_block(emp_name: str, ref_start: datetime) -> Optional[datetime]:
+    return DAY.busy.next_start(emp_name, ref_start)
+
+def has_conflict(emp_name: str, start_time: datetime, end_time: datetime) -> Optional[str]:
+    rsv = next_reservation_block(emp_name, start_time)
+    if rsv is not None and (end_time > rsv or start_time >= rsv):
+        return f"与预约 {rsv.strftime('%H:%M')} 冲突"
+    nxt = next_assignment_block(emp_name, start_time)
+    if nxt is not None and (end_time > nxt or start_time >= nxt):
+        return f"与后续分配 {nxt.strftime('%H:%M')} 冲突"
+    return None
+
+@locked
+def assign_customer(service: Dict, arrival: datetime, prefer_employee: Optional[str] = None) -> Optional[Dict]:
+    if not S.employees: return None
+    found = find_assignment(service, arrival, prefer_employee)
+    if found is None:
+        return None
+    return book_assignment(service, *found)
+
+def book_assignment(service: Dict, emp: Dict, start: datetime, end: datetime) -> Dict:
+    """
+    生成分配记录并更新员工、索引与日志；调用方需已持有 DAY.lock。
+    """
+    record = {
+        "customer_id": S._customer_seq,
+        "service": service["name"], "minutes": service["minutes"],
+        "employee": emp["name"], "start": start, "end": end,
+        "price": service["price"],
+        "status": status_at(start, end, now()),
+        "pay_cash": 0.0, "pay_transfer": 0.0, "pay_eftpos": 0.0, "pay_voucher": 0.0,
+        "payment_note": ""
+    }
+    S._customer_seq += 1
+    S.assignments.append(record)
+    DAY.assignments_by_id[record["customer_id"]] = record
+    DAY.busy.add(emp["name"], start, end, record["customer_id"])
+    DAY.track(record)
+    post_revenue(record)
+    # 填进较早的空档时不改变其最晚空闲时间
+    settle_employee(emp)
+    journal(put("assignments", record), put("employees", emp), seq_event())
+    return record
+
+def plan_seats(services: List[Dict], arrival: datetime) -> List[Optional[Tuple[Dict, datetime, datetime]]]:
+    """
+    一次规划一组顾客（可混合项目），不改动任何数据。
+    在轮值队列的本地副本上推演，已规划的座位记在本地区间表里，找空档时一并避开；
+    可做员工越少的项目越先排，避免稀缺的正式员工被 NS 类项目占满。
+    返回与 services 一一对应的 (员工, 开始, 结束)，无人可做为 None。
+    """
+    plan: List[Optional[Tuple[Dict, datetime, datetime]]] = [None] * len(services)
+    if not services or not S.employees: return plan
+    order = DAY.rotation.ordered()
+    queue = RotationQueue()
+    for e in order:
+        queue.update(e["name"], rotation_key(e), e)
+    capable = {}
+    for s in services:
+        if s["name"] not in capable:
+            capable[s["name"]] = sum(1 for e in order if can_employee_do(e, s))
+    planned = IntervalIndex()
+    free, served = {}, {}
+    for i in sorted(range(len(services)), key=lambda i: capable[services[i]["name"]]):
+        service = services[i]
+        if not capable[service["name"]]: continue
+        plan[i] = find_assignment(service, arrival, queue=queue, extra=(planned,))
+        e, start_time, end_time = plan[i]
+        planned.add(e["name"], start_time, end_time, i)
+        free[e["name"]] = max(free.get(e["name"], e["next_free"]), end_time)
+        served[e["name"]] = served.get(e["name"], 0) + 1
+        queue.update(e["name"], (free[e["name"]], e["check_in"], e["served_count"] + served[e["name"]]), e)
+    return plan
+
+DISPATCH_POLICIES = {"rotation": "轮值顺序（按到店先后逐批补位）", "matching": "全局最优匹配（总等待最少）"}
+
+def dispatch_policy() -> str:
+    return DAY.policy
+
+@locked
+def set_dispatch_policy(policy: str):
+    DAY.policy = policy
+    journal([storage.ev_set("policy", policy)])
+
+def match_waiting(items: List[Dict]) -> Dict[int, int]:
+    """
+    把等待批次展开成单个座位，每轮让每位员工至多接一位：
+    每位员工取其最早放得下的空档，费用 = 顾客等待分钟 + 员工为等顾客空出的分钟，能力不符为不可行；
+    轮值顺位只作极小的平局项。先求最多配对再求最小费用，落账后进入下一轮。
+    返回 {批次ID: 本次分配人数}。
+    """
+    seats = [item for item in items for _ in range(item["count"])]
+    placed: Dict[int, int] = {}
+    t = now()
+    while seats:
+        emps = DAY.rotation.ordered()
+        cost, slots = [], []
+        for item in seats:
+            row, srow = [], []
+            for rank, e in enumerate(emps):
+                if not can_employee_do(e, item["service"]):
+                    row.append(INFEASIBLE); srow.append(None); continue
+                start, end = find_slot(e, item["service"]["minutes"], max(item["arrival"], t))
+                idle = max(start - max(e["next_free"], t), timedelta(0))
+                row.append(((start - item["arrival"]) + idle).total_seconds() / 60 + rank * 1e-3)
+                srow.append((start, end))
+            cost.append(row); slots.append(srow)
+        pairs = min_cost_matching(cost)
+        if not pairs: break
+        for i, j in pairs:
+            book_assignment(seats[i]["service"], emps[j], *slots[i][j])
+            placed[seats[i]["customer_id"]] = placed.get(seats[i]["customer_id"], 0) + 1
+        done = {i for i, _ in pairs}
+        seats = [x for i, x in enumerate(seats) if i not in done]
+    return placed
+
+@locked
+def dispatch_waiting(classes, policy: Optional[str] = None) -> List[Dict]:
+    """
+    有员工空出（签到、提前结束、删除/缩短记录）时调用：只看这些能力类别下的等待批次补位。
+    policy 为 "rotation"（按到店先后逐批走轮值）或 "matching"（整体最小费用匹配），默认取 DAY.policy。
+    返回整批分配完的等待批次。
+    """
+    items = DAY.waitq.items(classes); t = now()
+    if (policy or dispatch_policy()) == "matching":
+        placed = match_waiting(items)
+    else:
+        placed = {}
+        for item in items:
+            n = 0
+            # 等待中的顾客最早从现在开始
+            while n < item["count"] and assign_customer(item["service"], max(item["arrival"], t)) is not None:
+                n += 1
+            placed[item["customer_id"]] = n
+    flushed, shrunk = [], []
+    for item in items:
+        assigned = placed.get(item["customer_id"], 0)
+        if assigned == item["count"]:
+            flushed.append(item)
+            DAY.waitq.discard(item["customer_id"])
+        elif assigned:
+            item["count"] -= assigned
+            shrunk.append(item)
+    if flushed:
+        done = {w["customer_id"] for w in flushed}
+        S.waiting = [w for w in S.waiting if w["customer_id"] not in done]
+    journal(drop("waiting", [w["customer_id"] for w in flushed]), put("waiting", *shrunk))
+    return flushed
+
+def dispatch_for(names) -> List[Dict]:
+    classes = {capability_class(DAY.employees_by_name[n]) for n in names if n in DAY.employees_by_name}
+    return dispatch_waiting(classes) if classes and S.waiting else []
+
+def try_flush_waiting():
+    # 手动全量重试：所有类别
+    return dispatch_waiting(ROLES)
+
+@locked
+def register_group(services: List[Dict], arrival: datetime):
+    """
+    团体到店：一次规划全部座位后统一落账，排不上的按项目合并成等待批次。
+    返回 {"assigned":[已分配customer_id,...], "waiting":[等待批次customer_id,...]}
+    """
+    created_assigned = []
+    created_waiting = []
+    left: Dict[str, list] = {}
+    for service, seat in zip(services, plan_seats(services, arrival)):
+        if seat is None:
+            left.setdefault(service["name"], [service, 0])[1] += 1
+            continue
+        created_assigned.append(book_assignment(service, *seat)["customer_id"])
+
+    for service, n in left.values():
+        batch_id = S._customer_seq
+        S.waiting.append({
+            "customer_id": batch_id, "service": service,
+            "arrival": arrival, "count": n
+        })
+        DAY.waitq.add(batch_id, arrival, S.waiting[-1], waiting_classes(service))
+        created_waiting.append(batch_id)
+        S._customer_seq += 1
+        journal(put("waiting", S.waiting[-1]), seq_event())
+
+    return {"assigned": created_assigned, "waiting": created_waiting}
+
+def register_customers(service_name: str, arrival: datetime, count: int = 1):
+    """
+    返回 {"assigned":[已分配customer_id,...], "waiting":[等待批次customer_id,...]}；项目不存在返回 None。
+    """
+    service = DAY.services_by_name.get(service_name)
+    if not service:
+        return None
+    return register_group([service] * count, arrival)
+
+@locked
+def refresh_status():
+    """
+    只处理开始/结束时刻已过的记录，代价与状态变化数成正比。
+    """
+    changed = []
+    t = now()
+    for rid in DAY.transitions.pop_due(t):
+        rec = DAY.assignments_by_id.get(rid)
+        if rec is None: continue
+        status = status_at(rec["start"], rec["end"], t)
+        if status != rec["status"]:
+            rec["status"] = status
+            post_revenue(rec)
+            changed.append(rec)
+        DAY.track(rec, t)
+    journal(put("assignments", *changed), status_only=True)
+
+@locked
+def apply_due_reservations():
+    """
+    只弹出已到开始时间的未完成预约，按指定技师落单；没有到期预约时 O(1)。
+    """
+    changed = []; t = now()
+    for rid in DAY.due_reservations.pop_due(t):
+        r = DAY.reservations_by_id.get(rid)
+        if r is None or r.get("status","pending") == "done": continue
+        service = DAY.services_by_name.get(r["service"])
+        rec = assign_customer(service, r["start"], prefer_employee=r["employee"]) if service else None
+        if rec is None:
+            # 项目已删除或暂时排不上：稍后再试
+            DAY.due_reservations.schedule(rid, t + RESERVATION_RETRY)
+            continue
+        r["status"] = "done"; DAY.held.discard(rid)
+        changed.append(r)
+    journal(put("reservations", *changed))
+
+# ===== Add-on / Extension utilities =====
+# ===== Add-on / Extension utilities =====
+def remember_undo(undo: Optional[Dict], info: Dict):
+    if undo is not None:
+        undo.clear(); undo.update(info)
+
+@locked
+def extend_or_add_on(record_id: int, mode: str, extra_minutes: int,
+                     service_name: Optional[str] = None,
+                     price_override: Optional[float] = None,
+                     undo: Optional[Dict] = None) -> Optional[str]:
+    """
+    成功返回 None，否则返回原因；给了 undo 字典时写入撤销所需的旧值。
+    """
+    rec = DAY.assignments_by_id.get(record_id)
+    if not rec:
+        return "未找到该记录"
+    emp = rec["employee"]
+    base_end = rec["end"]
+
+    if mode == "extend":
+        # —— 先保存“变更前”的旧值，用于撤销 ——
+        old_end = base_end
+        old_minutes = rec["minutes"]
+        old_price = rec["price"]
+
+        new_end = base_end + timedelta(minutes=extra_minutes)
+        msg = has_conflict(emp, base_end, new_end)
+        if msg:
+            return msg
+
+        # 计算价格（注意 per_min 用“旧分钟/旧价格”）
+        if price_override is not None:
+            new_price = float(price_override)
+        else:
+            per_min = (old_price / max(old_minutes, 1))
+            new_price = round(old_price + per_min * extra_minutes, 2)
+
+        # 应用修改
+        rec["end"] = new_end
+        rec["price"] = new_price
+        rec["minutes"] = old_minutes + extra_minutes
+        DAY.busy.add(emp, rec["start"], new_end, record_id)
+        DAY.track(rec)
+        post_revenue(rec)
+
+        # 更新员工 next_free
+        e = DAY.employees_by_name.get(emp)
+        if e is not None:
+            settle_employee(e)
+
+        journal(put("assignments", rec), put("employees", *([e] if e else [])))
+
+        # —— 记录最近一次“加时”以便撤销 ——（用旧值）
+        remember_undo(undo, {
+            "mode": "extend",
+            "target_id": record_id,
+            "new_id": None,
+            "old_end": old_end.isoformat(),
+            "old_minutes": old_minutes,
+            "old_price": old_price,
+        })
+        return None
+
+    else:
+        # 另起新单
+        start_time = base_end
+        if service_name:
+            svc = DAY.services_by_name.get(service_name)
+            if not svc:
+                return "未找到追加的项目"
+            end_time = start_time + timedelta(minutes=svc["minutes"])
+            msg = has_conflict(emp, start_time, end_time)
+            if msg:
+                return msg
+            new_rec = {
+                "customer_id": S._customer_seq,
+                "service": svc["name"], "minutes": svc["minutes"], "employee": emp,
+                "start": start_time, "end": end_time, "price": svc["price"],
+                "status": status_at(start_time, end_time, now()),
+                "pay_cash": 0.0, "pay_transfer": 0.0, "pay_eftpos": 0.0, "pay_voucher": 0.0,
+                "payment_note": "追加项目",
+            }
+        else:
+            minutes = int(extra_minutes)
+            end_time = start_time + timedelta(minutes=minutes)
+            msg = has_conflict(emp, start_time, end_time)
+            if msg:
+                return msg
+            # 以“旧价/旧分钟”计算本次追加单价格（或自定义）
+            per_min = (rec["price"] / max(rec["minutes"], 1))
+            price = float(price_override) if price_override is not None else round(per_min * minutes, 2)
+            new_rec = {
+                "customer_id": S._customer_seq,
+                "service": f"Add-on (+{minutes} mins)", "minutes": minutes, "employee": emp,
+                "start": start_time, "end": end_time, "price": price,
+                "status": status_at(start_time, end_time, now()),
+                "pay_cash": 0.0, "pay_transfer": 0.0, "pay_eftpos": 0.0, "pay_voucher": 0.0,
+                "payment_note": "加时",
+            }
+
+        S._customer_seq += 1
+        S.assignments.append(new_rec)
+        DAY.assignments_by_id[new_rec["customer_id"]] = new_rec
+        DAY.busy.add(emp, new_rec["start"], new_rec["end"], new_rec["customer_id"])
+        DAY.track(new_rec)
+        post_revenue(new_rec)
+
+        e = DAY.employees_by_name.get(emp)
+        if e is not None:
+            settle_employee(e)
+
+        journal(put("assignments", new_rec), put("employees", *([e] if e else [])), seq_event())
+
+        # —— 记录最近一次“另起一单”以便撤销 ——（删除新建记录即可）
+        remember_undo(undo, {
+            "mode": "add",
+            "target_id": record_id,
+            "new_id": new_rec["customer_id"],
+            "old_end": base_end.isoformat(),
+            "old_minutes": None,
+            "old_price": None,
+        })
+        return None
+
+
+@locked
+def finish_early(record_id: int, t: datetime) -> Optional[str]:
+    """
+    服务提前结束：把记录结束时间改为 t，并让该员工的空位立即给等待队列使用。
+    """
+    rec = DAY.assignments_by_id.get(record_id)
+    if not rec:
+        return "未找到该记录"
+    if not (rec["start"] < t < rec["end"]):
+        return "该记录不在进行中"
+    # 价格与项目时长保持不变，只释放员工时间
+    rec["end"] = t
+    rec["status"] = "已完成"
+    DAY.busy.add(rec["employee"], rec["start"], t, record_id)
+    DAY.track(rec)
+    post_revenue(rec)
+    e = DAY.employees_by_name.get(rec["employee"])
+    if e is not None:
+        settle_employee(e)
+        journal(put("employees", e))
+    journal(put("assignments", rec))
+    dispatch_for([rec["employee"]])
+    return None
+
+# ===== Utilities for deletions =====
+@locked
+def delete_assignments_by_ids(ids):
+    ids = set(ids)
+    freed = {DAY.assignments_by_id[i]["employee"] for i in ids if i in DAY.assignments_by_id}
+    S.assignments = [r for r in S.assignments if r["customer_id"] not in ids]
+    for i in ids:
+        DAY.busy.discard(i); DAY.transitions.cancel(i); DAY.ledger.discard(i)
+        DAY.assignments_by_id.pop(i, None)
+    emps = [DAY.employees_by_name[n] for n in freed if n in DAY.employees_by_name]
+    for e in emps: settle_employee(e)
+    journal(drop("assignments", ids), put("employees", *emps))
+    dispatch_for(freed)
+
+@locked
+def delete_waiting_by_ids(ids):
+    ids = set(ids)
+    S.waiting = [w for w in S.waiting if w["customer_id"] not in ids]
+    for i in ids: DAY.waitq.discard(i)
+    journal(drop("waiting", ids))
+
+@locked
+def delete_reservations_by_ids(ids):
+    ids = set(ids)
+    S.reservations = [r for r in S.reservations if r["id"] not in ids]
+    for i in ids:
+        DAY.held.discard(i); DAY.due_reservations.cancel(i); DAY.reservations_by_id.pop(i, None)
+    journal(drop("reservations", ids))
+
+@locked
+def delete_employees_by_names(names):
+    names = set(names)
+    S.employees = [e for e in S.employees if e["name"] not in names]
+    for n in names:
+        DAY.rotation.remove(n); DAY.employees_by_name.pop(n, None)
+    journal(drop("employees", names))
+
+@locked
+def check_in_employee(name: str, role: str, t: datetime) -> bool:
+    """
+    签到或更新签到时间；返回该员工此前是否已签到。
+    """
+    ex = DAY.employees_by_name.get(name)
+    existed = ex is not None
+    if ex:
+        ex["check_in"] = t; ex["role"] = role
+        if ex["next_free"] < t: ex["next_free"] = t
+    else:
+        ex = {
+            "name": name, "check_in": t, "next_free": t,
+            "served_count": 0, "role": role
+        }
+        S.employees.append(ex)
+        DAY.employees_by_name[name] = ex
+    S.employees = sorted(S.employees, key=lambda e: e["check_in"])
+    touch_employee(ex)
+    journal(put("employees", ex)); dispatch_for([name])
+    return existed
+
+@locked
+def save_services(services: List[Dict]):
+    """
+    替换服务项目目录：预约占用时长取自项目时长，可做矩阵随之重编译，所以整体重建索引。
+    """
+    S.services = services
+    DAY.reindex()
+    journal([storage.ev_set("services", services)])
+
+@locked
+def add_reservation(customer: str, service_name: str, employee: str, start_dt: datetime) -> Dict:
+    rid = (max([r["id"] for r in S.reservations], default=0) + 1)
+    S.reservations.append({
+        "id": rid, "customer": customer or f"预约{rid}",
+        "service": service_name, "employee": employee,
+        "start": start_dt, "status": "pending"
+    })
+    rv = S.reservations[-1]
+    DAY.reservations_by_id[rid] = rv
+    DAY.held.add(employee, start_dt, reservation_end(rv, DAY.services_by_name), rid)
+    DAY.due_reservations.schedule(rid, start_dt)
+    journal(put("reservations", rv))
+    return rv
+
+@locked
+def clear_day():
+    reset_state(S)
+    DAY.reindex()
+    DAY.version += 1
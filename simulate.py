@@ -0,0 +1,196 @@
+# simulate.py
+# 离线模拟一天的营业：按小时泊松到店、预约、加时，全部经由 scheduler.py 的真实函数在虚拟时钟下执行，
+# 不读写任何数据文件。用于估算人手，以及放大 10×–100× 客流时测排班本身的耗时。
+#   python simulate.py                       # 默认客流与人手
+#   python simulate.py --scale 20 --seed 7   # 客流与人手同时放大 20 倍
+#   python simulate.py --staff 3,1,1 --policy matching --json
+import argparse
+import heapq
+import itertools
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import scheduler
+from scheduler import TZ, DayStore, DEFAULT_SERVICES, ROLES, role_allows
+
+# 每小时平均到店批次（营业 10:00–21:00）
+HOURLY_ARRIVALS = {10: 2, 11: 3, 12: 4, 13: 4, 14: 3, 15: 3, 16: 4, 17: 5, 18: 5, 19: 4, 20: 2}
+OPEN_HOUR, CLOSE_HOUR = 10, 21
+# 一批到店人数的分布
+GROUP_SIZES = [1, 1, 1, 1, 1, 1, 2, 2, 3, 4]
+# 默认人手：正式 / 新员工-初级 / 新员工-中级（顺序同 ROLES）
+DEFAULT_STAFF = (4, 1, 1)
+TICK_MINUTES = 5
+
+def poisson_times(rng: random.Random, day: datetime, scale: float) -> List[datetime]:
+    """
+    按小时分段的泊松过程：段内指数间隔。
+    """
+    out = []
+    for hour, rate in HOURLY_ARRIVALS.items():
+        lam = rate * scale
+        if lam <= 0: continue
+        t = day.replace(hour=hour)
+        end = t + timedelta(hours=1)
+        while True:
+            t += timedelta(hours=rng.expovariate(lam))
+            if t >= end: break
+            out.append(t)
+    return out
+
+class Observer:
+    """
+    记录每个调用前后的差异，把新生成的分配记录对回顾客到店/预约时间，得到等待时长。
+    同一项目内按先到先开始配对，总等待时长是精确的。
+    """
+    def __init__(self):
+        self.waits: List[float] = []
+        self.cost: Dict[str, List[float]] = {}
+
+    def call(self, label: str, fn, *args, arrival=None, **kwargs):
+        S = scheduler.S
+        seq = S._customer_seq
+        before = {w["customer_id"]: (w["service"]["name"], w["arrival"], w["count"]) for w in S.waiting}
+        due = {r["id"]: r for r in S.reservations if r.get("status", "pending") != "done"}
+        t0 = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.cost.setdefault(label, []).append(time.perf_counter() - t0)
+
+        consumed: Dict[str, List[datetime]] = {}
+        after = {w["customer_id"]: w["count"] for w in S.waiting}
+        for wid, (svc, arr, n) in before.items():
+            consumed.setdefault(svc, []).extend([arr] * (n - after.get(wid, 0)))
+        for rid, r in due.items():
+            if r.get("status") == "done":
+                consumed.setdefault(r["service"], []).append(r["start"])
+        if arrival is not None and result is not None:
+            consumed.setdefault(args[0], []).extend([arrival] * len(result["assigned"]))
+        new = [r for r in S.assignments if r["customer_id"] >= seq]
+        for svc, arrivals in consumed.items():
+            starts = sorted(r["start"] for r in new if r["service"] == svc)
+            for a, s in zip(sorted(arrivals), starts):
+                self.waits.append((s - a).total_seconds() / 60)
+        return result
+
+def run(scale: float = 1.0, seed: int = 0, staff=DEFAULT_STAFF, policy: str = "rotation",
+        reserve_ratio: float = 0.1, addon_ratio: float = 0.1) -> Dict:
+    rng = random.Random(seed)
+    day = datetime.now(TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+    opening, closing = day.replace(hour=OPEN_HOUR), day.replace(hour=CLOSE_HOUR)
+    store = DayStore("sim-" + day.strftime("%Y-%m-%d"))
+    store.policy = policy
+    scheduler.bind(store)
+    S = store.state
+    services = DEFAULT_SERVICES
+    obs = Observer()
+
+    # 事件堆：(时间, 序号, 类型, 参数)
+    events = []
+    seq = itertools.count()
+    def at(t, kind, *payload): heapq.heappush(events, (t, next(seq), kind, payload))
+
+    names, roster = [], []
+    for role, n in zip(ROLES, staff):
+        for i in range(max(int(round(n * scale)), 0)):
+            name = f"{role}{i + 1}"
+            names.append(name); roster.append((name, role))
+            # 开门后 0–30 分钟陆续签到
+            at(opening + timedelta(minutes=rng.randint(0, 30)), "checkin", name, role)
+    for t in poisson_times(rng, day, scale):
+        svc = rng.choice(services)
+        if rng.random() < reserve_ratio:
+            # 提前 1–3 小时电话预约，指定一位技师
+            booked = max(opening, t - timedelta(hours=rng.uniform(1, 3)))
+            at(booked, "reserve", svc["name"], t)
+        else:
+            at(t, "arrive", svc["name"], rng.choice(GROUP_SIZES))
+    t = opening
+    while t <= closing + timedelta(hours=3):
+        at(t, "tick"); t += timedelta(minutes=TICK_MINUTES)
+
+    queue_len = []
+    addons = dropped = 0
+    while events:
+        t, _, kind, payload = heapq.heappop(events)
+        # 虚拟时钟：每个事件内 now() 固定为事件时间
+        scheduler.freeze_clock(t)
+        if kind == "checkin":
+            obs.call("check_in_employee", scheduler.check_in_employee, payload[0], payload[1], t)
+        elif kind == "arrive":
+            res = obs.call("register_customers", scheduler.register_customers, payload[0], t,
+                           count=payload[1], arrival=t)
+            if res and rng.random() < addon_ratio * len(res["assigned"]):
+                rid = rng.choice(res["assigned"])
+                at(store.assignments_by_id[rid]["end"] - timedelta(minutes=5), "addon", rid)
+        elif kind == "reserve":
+            # 按排班表（而非已签到的员工）指定技师：开门时就有预约，技师可能还没签到
+            mask = store.mask_of(store.services_by_name[payload[0]])
+            emps = [n for n, role in roster if role_allows(role, mask)]
+            if emps:
+                obs.call("add_reservation", scheduler.add_reservation, "", payload[0], rng.choice(emps), payload[1])
+            else:
+                dropped += 1
+        elif kind == "addon":
+            mode = rng.choice(["extend", "add"])
+            err = obs.call("extend_or_add_on", scheduler.extend_or_add_on, payload[0], mode, rng.choice([10, 15, 30]))
+            addons += err is None
+        else:
+            obs.call("refresh_status", scheduler.refresh_status)
+            obs.call("apply_due_reservations", scheduler.apply_due_reservations)
+            obs.call("try_flush_waiting", scheduler.try_flush_waiting)
+            if t <= closing:
+                queue_len.append((t.strftime("%H:%M"), sum(w["count"] for w in S.waiting)))
+    scheduler.unfreeze_clock()
+
+    # 指标
+    busy = {n: 0.0 for n in names}
+    revenue = 0.0
+    for r in S.assignments:
+        busy[r["employee"]] = busy.get(r["employee"], 0.0) + (r["end"] - r["start"]).total_seconds() / 60
+        revenue += r["price"]
+    shift = {e["name"]: max((closing - e["check_in"]).total_seconds() / 60, 1) for e in S.employees}
+    util = {n: round(busy[n] / shift[n], 3) for n in shift}
+    waits = sorted(obs.waits)
+    pct = lambda q: round(waits[min(int(q * len(waits)), len(waits) - 1)], 1) if waits else 0.0
+    return {
+        "scale": scale, "seed": seed, "policy": policy, "staff": len(names),
+        "customers": len(waits), "records": len(S.assignments), "addons": addons,
+        "reservations_dropped": dropped,
+        "left_waiting": sum(w["count"] for w in S.waiting),
+        "wait_min": {"mean": round(sum(waits) / len(waits), 1) if waits else 0.0,
+                     "p50": pct(0.5), "p90": pct(0.9), "max": pct(1.0)},
+        "utilization": {"mean": round(sum(util.values()) / max(len(util), 1), 3), "by_employee": util},
+        "revenue": round(revenue, 2),
+        "queue_len": queue_len,
+        "cost_ms": {k: {"calls": len(v), "total": round(sum(v) * 1000, 1), "mean": round(sum(v) / len(v) * 1000, 3)}
+                    for k, v in obs.cost.items()},
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="排班离线模拟（虚拟时钟，不读写数据文件）")
+    ap.add_argument("--scale", type=float, default=1.0, help="客流与人手放大倍数")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--staff", default=",".join(map(str, DEFAULT_STAFF)), help="正式,新员工-初级,新员工-中级 人数")
+    ap.add_argument("--policy", choices=list(scheduler.DISPATCH_POLICIES), default="rotation")
+    ap.add_argument("--reserve", type=float, default=0.1, help="预约占到店的比例")
+    ap.add_argument("--addon", type=float, default=0.1, help="加时/追加的概率")
+    ap.add_argument("--json", action="store_true", help="输出完整 JSON")
+    a = ap.parse_args()
+    m = run(a.scale, a.seed, tuple(int(x) for x in a.staff.split(",")), a.policy, a.reserve, a.addon)
+    if a.json:
+        print(json.dumps(m, ensure_ascii=False, indent=2)); return
+    print(f"规模 ×{m['scale']}  员工 {m['staff']}  顾客 {m['customers']}  记录 {m['records']}  加时 {m['addons']}  未分配 {m['left_waiting']}"
+          f"  无人可约 {m['reservations_dropped']}")
+    w = m["wait_min"]
+    print(f"等待(分钟)  平均 {w['mean']}  P50 {w['p50']}  P90 {w['p90']}  最长 {w['max']}")
+    print(f"平均利用率 {m['utilization']['mean']:.0%}   营业额 ${m['revenue']:.2f}")
+    print("等待队列峰值", max((n for _, n in m["queue_len"]), default=0))
+    print("排班耗时(ms)")
+    for k, c in sorted(m["cost_ms"].items(), key=lambda kv: -kv[1]["total"]):
+        print(f"  {k:<24} {c['calls']:>6} 次  合计 {c['total']:>9.1f}  平均 {c['mean']:.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,530 @@
+# storage.py
+# 当日数据持久化（可插拔）：
+#   JsonStore   —— 全量快照 data/YYYY-MM-DD.json + 追加式变更日志 data/YYYY-MM-DD.log.jsonl
+#   SqliteStore —— data/coral.db，按行更新，支持跨日期范围查询
+# 两者接口一致：load / apply / write_snapshot / clear / is_stale；JSON 快照格式同时作为导入导出格式。
+#
+# 多进程：写入前先拿咨询锁（JSON 用 fcntl，SQLite 用自身的写锁），等待时间有上限；
+# 磁盘上带单调递增的版本号。本进程落后时，若其他进程改的行与本次写入不重叠则合并，否则拒绝。
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows：无 fcntl，退化为不加文件锁
+    fcntl = None
+
+# 等锁上限（秒），超时抛 StoreBusy，界面不会卡住
+LOCK_TIMEOUT_S = 2.0
+
+class StoreBusy(Exception):
+    """在 LOCK_TIMEOUT_S 内没有拿到写锁。"""
+
+class StaleWrite(Exception):
+    """磁盘数据已被其他进程修改，且与本次写入改到了同一行。"""
+
+# 各表的主键字段
+TABLE_KEYS = {
+    "employees": "name",
+    "assignments": "customer_id",
+    "waiting": "customer_id",
+    "reservations": "id",
+}
+
+# ===== Events =====
+def ev_put(table: str, row: Dict) -> Dict:
+    return {"op": "put", "table": table, "row": row}
+
+def ev_del(table: str, key) -> Dict:
+    return {"op": "del", "table": table, "key": key}
+
+def ev_set(field: str, value) -> Dict:
+    return {"op": "set", "field": field, "value": value}
+
+def event_key(ev: Dict) -> tuple:
+    """
+    事件作用的行：("set", 字段) 或 (表, 主键)。
+    """
+    if ev["op"] == "set": return ("set", ev["field"])
+    key = ev["row"][TABLE_KEYS[ev["table"]]] if ev["op"] == "put" else ev["key"]
+    return (ev["table"], key)
+
+def apply_event(data: Dict, ev: Dict) -> None:
+    op = ev.get("op")
+    if op == "ver":
+        return
+    if op == "set":
+        data[ev["field"]] = ev["value"]
+        return
+    table = ev["table"]; key_field = TABLE_KEYS[table]
+    rows = data.setdefault(table, [])
+    if op == "put":
+        row = ev["row"]
+        for i, r in enumerate(rows):
+            if r.get(key_field) == row[key_field]:
+                rows[i] = row
+                break
+        else:
+            rows.append(row)
+    elif op == "del":
+        data[table] = [r for r in rows if r.get(key_field) != ev["key"]]
+
+@contextmanager
+def file_lock(path: Path, timeout: float = LOCK_TIMEOUT_S):
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise StoreBusy(f"{path.name} 正被其他进程占用")
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+# ===== JSON：快照 + 日志 =====
+class JsonStore:
+    """
+    日志每行一个事件，带所属批次的版本号 "v"；快照带 "_version"。
+    压缩后日志只保留一行 {"op":"ver","v":n}，因此日志末行总是当前版本。
+    例行压缩的 ver 行另记 "since"（上一份快照的版本）和 "changes"（被折叠的各批次改过的行，
+    [版本, 表, 主键]），落后不超过一次压缩的进程仍能逐行判断冲突；导入/清空的 ver 行没有这两项。
+    """
+    def __init__(self, data_dir: Path, compact_every: int = 200):
+        self.data_dir = Path(data_dir)
+        self.compact_every = compact_every
+        # 以下均按日期记录本进程最后一次读写时的情况
+        self._lines: Dict[str, int] = {}
+        self._version: Dict[str, int] = {}
+        self._offset: Dict[str, int] = {}
+        self._inode: Dict[str, Optional[int]] = {}
+        self._snap_inode: Dict[str, Optional[int]] = {}
+
+    def snapshot_path(self, day: str) -> Path:
+        return self.data_dir / f"{day}.json"
+
+    def journal_path(self, day: str) -> Path:
+        return self.data_dir / f"{day}.log.jsonl"
+
+    def _lock(self, day: str):
+        return file_lock(self.data_dir / f"{day}.lock")
+
+    def _inode_of(self, path: Path) -> Optional[int]:
+        try: return path.stat().st_ino
+        except FileNotFoundError: return None
+
+    def _read_journal(self, day: str, offset: int):
+        """
+        从 offset 读到最后一个完整行，返回 (事件列表, 新 offset)。
+        """
+        log = self.journal_path(day)
+        if not log.exists(): return [], 0
+        with open(log, "rb") as f:
+            f.seek(offset); buf = f.read()
+        end = buf.rfind(b"\n") + 1
+        events = []
+        for line in buf[:end].splitlines():
+            if not line.strip(): continue
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                # 进程中途退出时留下的半行，忽略即可
+                continue
+        return events, offset + end
+
+    def _disk_version(self, day: str) -> int:
+        log = self.journal_path(day)
+        if log.exists():
+            with open(log, "rb") as f:
+                f.seek(0, os.SEEK_END); size = f.tell()
+                f.seek(max(0, size - 8192)); tail = f.read()
+                lines = tail.splitlines()[::-1]
+                if size > 8192 and len(lines) == 1:
+                    # 只剩一行较长的 ver（压缩记录的改动较多）：从头读整行
+                    f.seek(0); lines = [f.readline()]
+            for line in lines:
+                try: return int(json.loads(line).get("v", 0))
+                except (json.JSONDecodeError, AttributeError): continue
+        snap = self.snapshot_path(day)
+        if snap.exists():
+            return int(json.loads(snap.read_text(encoding="utf-8")).get("_version", 0))
+        return 0
+
+    def version(self, day: str) -> int:
+        return self._version.get(day, 0)
+
+    def is_stale(self, day: str) -> bool:
+        return self._disk_version(day) != self._version.get(day, 0)
+
+    def load(self, day: str) -> Optional[Dict]:
+        """
+        读取快照并重放日志尾部；当天无任何数据时返回 None。
+        """
+        try:
+            with self._lock(day):
+                return self._load(day)
+        except StoreBusy:
+            # 只读：日志只追加、快照原子替换，不加锁读到的也是某个一致的版本
+            return self._load(day)
+
+    def _load(self, day: str) -> Optional[Dict]:
+        snap = self.snapshot_path(day)
+        data = json.loads(snap.read_text(encoding="utf-8")) if snap.exists() else {}
+        version = int(data.pop("_version", 0))
+        self._inode[day] = self._inode_of(self.journal_path(day))
+        self._snap_inode[day] = self._inode_of(snap)
+        events, offset = self._read_journal(day, 0)
+        for ev in events:
+            apply_event(data, ev)
+            version = max(version, int(ev.get("v", 0)))
+        self._lines[day] = len(events)
+        self._version[day] = version
+        self._offset[day] = offset
+        if not snap.exists() and not any(ev.get("op") != "ver" for ev in events):
+            return None
+        return data
+
+    def _catch_up(self, day: str) -> set:
+        """
+        读入其他进程在本进程上次读写之后的写入，返回它们改过的行（event_key 的集合）。
+        """
+        mine = self._version.get(day, 0)
+        if self._disk_version(day) == mine:
+            return set()
+        log = self.journal_path(day)
+        known = self._inode.get(day)
+        theirs = set()
+        if (self._inode_of(self.snapshot_path(day)) != self._snap_inode.get(day)
+                or (known is not None and self._inode_of(log) != known)):
+            # 快照/日志被替换过：若是例行压缩，ver 行记着被折叠的改动，从新日志开头接着读
+            foreign, offset = self._read_journal(day, 0)
+            head = foreign[0] if foreign else {}
+            if head.get("op") != "ver" or "changes" not in head or head["since"] > mine:
+                # 导入/清空，或落后超过一次压缩：无法逐行比对
+                raise StaleWrite("当日数据已被其他进程整体改写")
+            theirs = {(t, k) for v, t, k in head["changes"] if v > mine}
+            self._snap_inode[day] = self._inode_of(self.snapshot_path(day))
+            self._inode[day] = self._inode_of(log)
+            self._lines[day] = 0
+        else:
+            foreign, offset = self._read_journal(day, self._offset.get(day, 0))
+        for ev in foreign:
+            self._version[day] = max(self._version.get(day, 0), int(ev.get("v", 0)))
+        theirs |= {event_key(ev) for ev in foreign if ev.get("op") != "ver"}
+        self._offset[day] = offset
+        self._lines[day] = self._lines.get(day, 0) + len(foreign)
+        return theirs
+
+    def apply(self, day: str, events: List[Dict]) -> bool:
+        """
+        追加一批事件（同一个新版本号）。返回 True 表示同时合并了其他进程的写入，
+        调用方应重新 load；与其他进程改到同一行时抛出 StaleWrite，本批不写入。
+        """
+        if not events: return False
+        with self._lock(day):
+            theirs = self._catch_up(day)
+            if any(event_key(ev) in theirs for ev in events):
+                raise StaleWrite("与其他进程的写入冲突")
+            v = self._version.get(day, 0) + 1
+            payload = "".join(
+                json.dumps({**ev, "v": v}, ensure_ascii=False, separators=(",", ":")) + "\n"
+                for ev in events
+            ).encode("utf-8")
+            log = self.journal_path(day)
+            with open(log, "a+b") as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() > 0:
+                    # 上一次写入若中途中断（末尾没有换行），先补一个换行
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n": payload = b"\n" + payload
+                f.write(payload)
+                self._offset[day] = f.tell()
+            self._inode[day] = self._inode_of(log)
+            self._version[day] = v
+            self._lines[day] = self._lines.get(day, 0) + len(events)
+            if self._lines[day] >= self.compact_every:
+                self._compact(day)
+        return bool(theirs)
+
+    def compact(self, day: str) -> None:
+        with self._lock(day):
+            self._compact(day)
+
+    def _compact(self, day: str) -> None:
+        """
+        把日志折叠进快照；数据不变，ver 行记下被折叠的改动供其他进程比对（见类说明）。
+        """
+        events, _ = self._read_journal(day, 0)
+        head = events[0] if events and events[0].get("op") == "ver" else {}
+        changes = sorted({(int(ev["v"]),) + event_key(ev) for ev in events if ev.get("op") != "ver"},
+                         key=lambda c: c[0])
+        data = self._load(day)
+        if data is None: return
+        self._write_snapshot(day, data, {"since": int(head.get("v", 0)), "changes": changes})
+
+    def write_snapshot(self, day: str, data: Dict) -> None:
+        """
+        写入完整快照（临时文件 + 原子替换），并把日志重置为只含版本号的一行。
+        """
+        with self._lock(day):
+            self._catch_up_version(day)
+            self._write_snapshot(day, data)
+
+    def _catch_up_version(self, day: str) -> None:
+        self._version[day] = max(self._version.get(day, 0), self._disk_version(day))
+
+    def _write_snapshot(self, day: str, data: Dict, folded: Optional[Dict] = None) -> None:
+        v = self._version.get(day, 0) + 1
+        path = self.snapshot_path(day)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps({**data, "_version": v}, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
+        self._snap_inode[day] = self._inode_of(path)
+        self._reset_journal(day, v, folded)
+
+    def _reset_journal(self, day: str, v: int, folded: Optional[Dict] = None) -> None:
+        log = self.journal_path(day)
+        tmp = log.with_name(log.name + ".tmp")
+        tmp.write_text(json.dumps({"op": "ver", "v": v, **(folded or {})}, ensure_ascii=False) + "\n",
+                       encoding="utf-8")
+        os.replace(tmp, log)
+        self._inode[day] = self._inode_of(log)
+        self._offset[day] = log.stat().st_size
+        self._version[day] = v
+        self._lines[day] = 0
+
+    def clear(self, day: str) -> None:
+        with self._lock(day):
+            self._catch_up_version(day)
+            self.snapshot_path(day).unlink(missing_ok=True)
+            self._snap_inode[day] = None
+            self._reset_journal(day, self._version.get(day, 0) + 1)
+
+# ===== SQLite：按行更新 =====
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS employees (
+    day TEXT NOT NULL, name TEXT NOT NULL,
+    check_in TEXT, next_free TEXT, served_count INTEGER, role TEXT,
+    PRIMARY KEY (day, name)
+);
+CREATE TABLE IF NOT EXISTS assignments (
+    day TEXT NOT NULL, customer_id INTEGER NOT NULL,
+    employee TEXT, service TEXT, minutes INTEGER, start TEXT, "end" TEXT,
+    price REAL, status TEXT,
+    pay_cash REAL, pay_transfer REAL, pay_eftpos REAL, pay_voucher REAL, payment_note TEXT,
+    extra TEXT,
+    PRIMARY KEY (day, customer_id)
+);
+CREATE TABLE IF NOT EXISTS reservations (
+    day TEXT NOT NULL, id INTEGER NOT NULL,
+    customer TEXT, service TEXT, employee TEXT, start TEXT, status TEXT,
+    PRIMARY KEY (day, id)
+);
+CREATE TABLE IF NOT EXISTS waiting (
+    day TEXT NOT NULL, customer_id INTEGER NOT NULL,
+    service TEXT, arrival TEXT, count INTEGER,
+    PRIMARY KEY (day, customer_id)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    day TEXT NOT NULL, field TEXT NOT NULL, value TEXT,
+    PRIMARY KEY (day, field)
+);
+-- 每个版本改过哪些行，用于判断并发写入是否冲突
+CREATE TABLE IF NOT EXISTS changes (
+    day TEXT NOT NULL, v INTEGER NOT NULL, tbl TEXT NOT NULL, key TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_changes_day_v ON changes (day, v);
+-- 主键均以 day 开头，按日期查询直接走主键索引
+CREATE INDEX IF NOT EXISTS idx_assignments_emp_start ON assignments (employee, start);
+CREATE INDEX IF NOT EXISTS idx_reservations_emp_start ON reservations (employee, start);
+"""
+
+# 各表的列（不含 day）；assignments 中未列出的字段放进 extra(JSON)
+COLUMNS = {
+    "employees": ["name", "check_in", "next_free", "served_count", "role"],
+    "assignments": ["customer_id", "employee", "service", "minutes", "start", "end", "price", "status",
+                    "pay_cash", "pay_transfer", "pay_eftpos", "pay_voucher", "payment_note"],
+    "reservations": ["id", "customer", "service", "employee", "start", "status"],
+    "waiting": ["customer_id", "service", "arrival", "count"],
+}
+JSON_COLUMNS = {"waiting": ("service",)}
+
+class SqliteStore:
+    """
+    版本号存于 meta(day, "_version")；写事务用 BEGIN IMMEDIATE 取得写锁，
+    等锁超过 LOCK_TIMEOUT_S 抛 StoreBusy。
+    """
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._version: Dict[str, int] = {}
+        with self._connect() as con:
+            con.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self, write: bool = False):
+        con = sqlite3.connect(self.db_path, timeout=LOCK_TIMEOUT_S)
+        con.row_factory = sqlite3.Row
+        try:
+            with con:  # 一次调用一个事务
+                if write: con.execute("BEGIN IMMEDIATE")
+                yield con
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                raise StoreBusy(str(e)) from e
+            raise
+        finally:
+            con.close()
+
+    def _disk_version(self, con, day: str) -> int:
+        r = con.execute("SELECT value FROM meta WHERE day = ? AND field = '_version'", (day,)).fetchone()
+        return int(json.loads(r["value"])) if r else 0
+
+    def _bump_version(self, con, day: str, keys) -> int:
+        v = self._disk_version(con, day) + 1
+        con.execute("INSERT OR REPLACE INTO meta (day, field, value) VALUES (?, '_version', ?)", (day, json.dumps(v)))
+        con.executemany("INSERT INTO changes (day, v, tbl, key) VALUES (?, ?, ?, ?)",
+                        [(day, v, k[0], json.dumps(k[1], ensure_ascii=False)) for k in keys])
+        self._version[day] = v
+        return v
+
+    def version(self, day: str) -> int:
+        return self._version.get(day, 0)
+
+    def is_stale(self, day: str) -> bool:
+        with self._connect() as con:
+            return self._disk_version(con, day) != self._version.get(day, 0)
+
+    # —— 行 <-> 字典 ——
+    def _to_params(self, table: str, day: str, row: Dict) -> List:
+        cols = COLUMNS[table]
+        vals = [day] + [
+            json.dumps(row.get(c), ensure_ascii=False) if c in JSON_COLUMNS.get(table, ()) else row.get(c)
+            for c in cols
+        ]
+        if table == "assignments":
+            extra = {k: v for k, v in row.items() if k not in cols}
+            vals.append(json.dumps(extra, ensure_ascii=False) if extra else None)
+        return vals
+
+    def _from_row(self, table: str, row: sqlite3.Row) -> Dict:
+        out = {}
+        for c in COLUMNS[table]:
+            v = row[c]
+            out[c] = json.loads(v) if c in JSON_COLUMNS.get(table, ()) and v is not None else v
+        if table == "assignments" and row["extra"]:
+            out.update(json.loads(row["extra"]))
+        return out
+
+    def _upsert(self, con, table: str, day: str, row: Dict) -> None:
+        cols = ["day"] + COLUMNS[table] + (["extra"] if table == "assignments" else [])
+        names = ", ".join(f'"{c}"' for c in cols)
+        marks = ", ".join("?" for _ in cols)
+        con.execute(f"INSERT OR REPLACE INTO {table} ({names}) VALUES ({marks})",
+                    self._to_params(table, day, row))
+
+    def _apply_one(self, con, day: str, ev: Dict) -> None:
+        op = ev.get("op")
+        if op == "set":
+            con.execute("INSERT OR REPLACE INTO meta (day, field, value) VALUES (?, ?, ?)",
+                        (day, ev["field"], json.dumps(ev["value"], ensure_ascii=False)))
+        elif op == "put":
+            self._upsert(con, ev["table"], day, ev["row"])
+        elif op == "del":
+            table = ev["table"]
+            con.execute(f'DELETE FROM {table} WHERE day = ? AND "{TABLE_KEYS[table]}" = ?',
+                        (day, ev["key"]))
+
+    # —— 存储接口 ——
+    def load(self, day: str) -> Optional[Dict]:
+        with self._connect() as con:
+            data: Dict = {}
+            for table in COLUMNS:
+                order = {"employees": "check_in", "reservations": "id"}.get(table, "customer_id")
+                rows = con.execute(f"SELECT * FROM {table} WHERE day = ? ORDER BY {order}", (day,)).fetchall()
+                data[table] = [self._from_row(table, r) for r in rows]
+            for r in con.execute("SELECT field, value FROM meta WHERE day = ?", (day,)):
+                data[r["field"]] = json.loads(r["value"])
+        self._version[day] = int(data.pop("_version", 0))
+        # 没有任何行，也没有记过字段（_customer_seq、services、policy 等）
+        if not any(data.get(t) for t in COLUMNS) and set(data) <= set(COLUMNS):
+            return None
+        return data
+
+    def apply(self, day: str, events: List[Dict]) -> bool:
+        """
+        同 JsonStore.apply：返回是否合并了其他进程的写入；行冲突时抛 StaleWrite。
+        """
+        if not events: return False
+        with self._connect(write=True) as con:
+            mine = self._version.get(day, 0)
+            theirs = set()
+            if self._disk_version(con, day) != mine:
+                for r in con.execute("SELECT tbl, key FROM changes WHERE day = ? AND v > ?", (day, mine)):
+                    theirs.add((r["tbl"], json.loads(r["key"]) if r["key"] is not None else None))
+                # 整体改写（导入/清空）记为 ("*", None)，与任何写入都冲突
+                if ("*", None) in theirs or any(event_key(ev) in theirs for ev in events):
+                    raise StaleWrite("与其他进程的写入冲突")
+            for ev in events:
+                self._apply_one(con, day, ev)
+            self._bump_version(con, day, [event_key(ev) for ev in events])
+        return bool(theirs)
+
+    def write_snapshot(self, day: str, data: Dict) -> None:
+        """
+        用一份完整数据（JSON 快照格式）替换当天所有行；也用于导入。
+        """
+        with self._connect(write=True) as con:
+            self._delete_day(con, day)
+            for table in COLUMNS:
+                for row in data.get(table, []):
+                    self._upsert(con, table, day, row)
+            for field in ("services", "_customer_seq", "policy"):
+                if field in data:
+                    self._apply_one(con, day, ev_set(field, data[field]))
+            self._bump_version(con, day, [("*", None)])
+
+    def clear(self, day: str) -> None:
+        with self._connect(write=True) as con:
+            self._delete_day(con, day)
+            self._bump_version(con, day, [("*", None)])
+
+    def _delete_day(self, con, day: str) -> None:
+        # 保留 _version，使版本号单调递增
+        for table in COLUMNS:
+            con.execute(f"DELETE FROM {table} WHERE day = ?", (day,))
+        con.execute("DELETE FROM meta WHERE day = ? AND field <> '_version'", (day,))
+        con.execute("DELETE FROM changes WHERE day = ?", (day,))
+
+    # —— 跨日期查询 ——
+    def query_assignments(self, day_from: str, day_to: str, employee: Optional[str] = None) -> List[Dict]:
+        """
+        返回 [day_from, day_to] 区间内的分配记录（含 day 字段），可按员工过滤。
+        """
+        sql = "SELECT * FROM assignments WHERE day BETWEEN ? AND ?"
+        params: List = [day_from, day_to]
+        if employee:
+            sql += " AND employee = ?"; params.append(employee)
+        sql += " ORDER BY day, start"
+        with self._connect() as con:
+            return [{"day": r["day"], **self._from_row("assignments", r)} for r in con.execute(sql, params)]
+
+# ===== Import / export (JSON 快照格式) =====
+def export_json(store, day: str) -> str:
+    return json.dumps(store.load(day) or {}, ensure_ascii=False, indent=2)
+
+def open_store(backend: str, data_dir: Path, compact_every: int = 200):
+    if backend == "sqlite":
+        return SqliteStore(Path(data_dir) / "coral.db")
+    return JsonStore(data_dir, compact_every=compact_every)
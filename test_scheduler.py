@@ -0,0 +1,35 @@
+# test_scheduler.py
+# scheduler.py 的回归测试（headless，不依赖 streamlit）：python -m pytest -q
+from datetime import datetime
+
+import pytest
+
+import scheduler
+from scheduler import TZ
+
+DAY0 = datetime(2026, 10, 17, tzinfo=TZ)
+
+def at(h: int, m: int = 0) -> datetime:
+    return DAY0.replace(hour=h, minute=m)
+
+@pytest.fixture
+def day():
+    scheduler.bind(scheduler.DayStore("test"))
+    scheduler.freeze_clock(at(10))
+    yield scheduler.DAY
+    scheduler.unfreeze_clock()
+
+def test_reservation_after_backfill_starts_on_time(day):
+    # 12:00 的预约之前、之后都被散客补满，next_free 已到 14:00
+    scheduler.check_in_employee("A", "正式", at(10))
+    scheduler.add_reservation("R", "NSB (60 mins)", "A", at(12))
+    for _ in range(3):
+        scheduler.register_customers("NSB (60 mins)", at(10))
+    assert day.employees_by_name["A"]["next_free"] == at(14)
+
+    scheduler.freeze_clock(at(12))
+    scheduler.apply_due_reservations()
+    rv = day.reservations_by_id[1]
+    assert rv["status"] == "done"
+    rec = scheduler.S.assignments[-1]
+    assert (rec["employee"], rec["start"], rec["end"]) == ("A", at(12), at(13))
@@ -0,0 +1,50 @@
+# test_storage.py
+# storage.py 的多进程回归测试：两个 JsonStore 实例模拟两个进程读写同一目录
+from types import SimpleNamespace
+
+import pytest
+
+import storage
+from scheduler import load_state
+
+DAY = "2026-10-17"
+
+def emp(name: str, served: int = 0) -> dict:
+    return {"name": name, "check_in": "2026-10-17T10:00:00+11:00", "next_free": "2026-10-17T10:00:00+11:00",
+            "served_count": served, "role": "正式"}
+
+@pytest.fixture
+def stores(tmp_path):
+    a = storage.JsonStore(tmp_path, compact_every=3)
+    b = storage.JsonStore(tmp_path, compact_every=3)
+    a.apply(DAY, [storage.ev_put("employees", emp("A")), storage.ev_put("employees", emp("B"))])
+    b.load(DAY)
+    return a, b
+
+def test_write_after_peer_compaction(stores):
+    a, b = stores
+    # a 写满 compact_every 行后压缩，快照与日志都被替换
+    a.apply(DAY, [storage.ev_put("employees", emp("A", 1))])
+    assert a.journal_path(DAY).read_text(encoding="utf-8").count("\n") == 1
+    # 改的是别的行：照常写入，并提示已合并他人写入
+    assert b.apply(DAY, [storage.ev_put("employees", emp("B", 1))]) is True
+    served = {e["name"]: e["served_count"] for e in a.load(DAY)["employees"]}
+    assert served == {"A": 1, "B": 1}
+    # 压缩前改过的行仍能识别为冲突
+    a.apply(DAY, [storage.ev_put("employees", emp("A", 2))] * 3)
+    with pytest.raises(storage.StaleWrite):
+        b.apply(DAY, [storage.ev_put("employees", emp("A", 9))])
+
+def test_reload_after_peer_clear(stores):
+    a, b = stores
+    state = SimpleNamespace(services=[], _pending={})
+    assert load_state(state, b, DAY)
+    assert [e["name"] for e in state.employees] == ["A", "B"]
+    a.clear(DAY)
+    with pytest.raises(storage.StaleWrite):
+        b.apply(DAY, [storage.ev_put("employees", emp("B", 1))])
+    # 重新载入得到空的一天，之后的写入不会把旧数据带回磁盘
+    assert not load_state(state, b, DAY)
+    assert state.employees == [] and state._customer_seq == 1
+    b.apply(DAY, [storage.ev_put("employees", emp("C"))])
+    assert [e["name"] for e in a.load(DAY)["employees"]] == ["C"]